@@ -0,0 +1,131 @@
+"""Benchmarks for the PVC data layer.
+
+Usage:
+    python bench.py [rows]
+
+Times importing handler, cli and gui in a fresh interpreter each. Then
+generates a synthetic bookings.csv (1,000,000 rows by default, with some
+cancellations as tombstones) in a temporary directory and compares loading
+it with csv.DictReader against the positional parser in storage, and
+against a binary snapshot of it. Then times looking up one user's bookings
+through the row offsets, which decodes only the rows found.
+"""
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Optional
+
+import storage
+from records import Booking
+
+def _best_of(runs: int, func) -> float:
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def import_time(module: str, runs: int = 5) -> Optional[float]:
+    """Return the best time taken to import module in a fresh interpreter,
+    interpreter startup excluded, or None if it cannot be imported."""
+    best = None
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if result.returncode:
+            return None
+        # Lines read 'import time: self [us] | cumulative | imported package'
+        for line in result.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                seconds = int(fields[1]) / 1e6
+                best = seconds if best is None else min(best, seconds)
+    return best
+
+def bench_import_time() -> None:
+    print("import time:")
+    for module in ('handler', 'cli', 'gui'):
+        seconds = import_time(module)
+        print(f"  {module + ':':<8} " + (f"{seconds * 1000:.1f}ms" if seconds is not None else "cannot be imported here"))
+
+def write_bookings(path: str, rows: int) -> None:
+    """Write a bookings file with one tombstone for every 20 bookings."""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(storage.CSV_HEADERS['bookings'])
+        for booking_id in range(1, rows + 1):
+            if booking_id % 20 == 0:
+                writer.writerow(storage._tombstone('bookings', str(booking_id - 1)))
+                continue
+            writer.writerow([booking_id, booking_id % 500 + 1, booking_id % 40 + 1, 2,
+                             'C4,C5', '25.00', '2025-10-01T18:30:00.000000'])
+
+def dictreader_load(path: str):
+    """The previous loader: one dict per row, folded by primary key."""
+    live = {}
+    with open(path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            if any(row[field] for field in Booking.FIELDS[1:]):
+                live[row['booking_id']] = Booking.from_dict(row)
+            else:
+                live.pop(row['booking_id'], None)
+    return list(live.values())
+
+def bench_bookings_load(rows: int = 1_000_000, runs: int = 3) -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'bookings.csv')
+        write_bookings(path, rows)
+        backend = storage.CSVBackend({'bookings': path})
+
+        _, records = backend.load('bookings')
+        assert len(records) == len(dictreader_load(path))
+
+        old = _best_of(runs, lambda: dictreader_load(path))
+        new = _best_of(runs, lambda: backend.load('bookings'))
+        print(f"bookings.csv: {rows:,} rows, {os.path.getsize(path) / 1e6:.1f} MB, {len(records):,} live")
+        print(f"  csv.DictReader:    {old:.3f}s")
+        print(f"  positional parser: {new:.3f}s ({old / new:.2f}x)")
+
+        backend.snapshot('bookings')
+        assert backend.load('bookings') == (backend.signature('bookings'), records)
+        snapshot = _best_of(runs, lambda: backend.load('bookings'))
+        print(f"  snapshot:          {snapshot:.3f}s ({old / snapshot:.2f}x), "
+              f"{os.path.getsize(os.path.join(tmpdir, 'bookings.snap')) / 1e6:.1f} MB")
+
+def _peak_memory(func) -> int:
+    """Return the most memory func had allocated at once, in bytes."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_bookings_find(rows: int = 1_000_000, runs: int = 3) -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'bookings.csv')
+        write_bookings(path, rows)
+
+        backend = storage.CSVBackend({'bookings': path})
+        first = _best_of(1, lambda: backend.find('bookings', 'user_id', '7'))
+        found = backend.find('bookings', 'user_id', '7')
+        assert found == [row for row in dictreader_load(path) if row['user_id'] == '7']
+        again = _best_of(runs, lambda: backend.find('bookings', 'user_id', '7'))
+        load = _best_of(1, lambda: backend.load('bookings'))
+
+        find_peak = _peak_memory(lambda: storage.CSVBackend({'bookings': path}).find('bookings', 'user_id', '7'))
+        load_peak = _peak_memory(lambda: storage.CSVBackend({'bookings': path}).load('bookings'))
+        print(f"bookings of one user: {len(found)} of {rows:,} rows")
+        print(f"  full load:                    {load:.3f}s, {load_peak / 1e6:.0f} MB peak")
+        print(f"  first lookup (offsets built): {first:.3f}s, {find_peak / 1e6:.0f} MB peak")
+        print(f"  later lookups:                {again * 1000:.2f}ms")
+
+if __name__ == "__main__":
+    bench_import_time()
+    bench_bookings_load(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
+    bench_bookings_find(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
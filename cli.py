@@ -63,6 +63,7 @@ def system_admin_menu(current_user: Dict):
             "2": "Manage Theatre Admins",
             "3": "Manage User Accounts",
             "4": "Ban/Unban Users",
+            "5": "Compact Bookings File",
             "0": "Logout"
         })
 
@@ -78,6 +79,10 @@ def system_admin_menu(current_user: Dict):
             manage_user_accounts()
         elif choice == "4":
             manage_user_bans()
+        elif choice == "5":
+            removed = handler.compact_bookings()
+            print(f"Bookings file compacted, {removed} dead row(s) removed.")
+            input("Press Enter to continue...")
         elif choice == "0":
             break
 
@@ -381,4 +386,5 @@ def check_user_status_by_email():
     input("\nPress Enter to continue...")
 
 if __name__ == '__main__':
+    handler.init()
     login_menu()
\ No newline at end of file
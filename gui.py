@@ -74,6 +74,7 @@ class CinemaGUI:
             
             st.markdown("---")
             if st.button("Logout", type="primary", icon=":material/logout:", use_container_width=True):
+                handler.release_user_holds(st.session_state.user['id'])
                 st.session_state.user = None
                 st.rerun()
         
@@ -90,16 +91,16 @@ class CinemaGUI:
         st.subheader(f":material/theater_comedy: Select Seats for: {movie['title']}")
         
         # Get seat layout information
-        seat_layout = handler.get_seat_layout(movie['id'])
+        user_id = st.session_state.user['id']
+        seat_layout = handler.get_seat_layout(movie['id'], user_id)
         if not seat_layout:
             st.error("Unable to load seat layout")
             return False
         
-        # Generate seat grid
-        seat_grid = handler.generate_seat_grid(
-            seat_layout['total_seats'], 
-            seat_layout['seats_per_row']
-        )
+        # Seat grid of the theatre's layout, "" marking aisle gaps
+        seat_grid = seat_layout['grid']
+        positions = seat_layout['positions']
+        sections = {first_row: name for name, first_row, _ in seat_layout['sections']}
         
         # Display seat information
         col1, col2, col3 = st.columns(3)
@@ -112,31 +113,62 @@ class CinemaGUI:
         
         # Legend
         st.markdown("#### Legend:")
-        col1, col2, col3 = st.columns(3)
+        col1, col2, col3, col4, col5, col6 = st.columns(6)
         with col1:
             st.markdown("🟢 **Available**")
         with col2:
             st.markdown("🔴 **Booked**")
         with col3:
+            st.markdown("🟠 **Held**")
+        with col4:
             st.markdown("🟡 **Selected**")
+        with col5:
+            st.markdown("♿ **Accessible**")
+        with col6:
+            st.markdown("⬛ **Unavailable**")
         
         # Initialize selected seats for this movie if not exists
         movie_id = movie['id']
         if movie_id not in st.session_state.selected_seats:
             st.session_state.selected_seats[movie_id] = []
         
+        # Let the server pick seats side by side for a group, when a group still fits
+        max_group_size = seat_layout['available_count']
+        if max_group_size >= 2:
+            col1, col2 = st.columns([1, 2])
+            with col1:
+                group_size = st.number_input(
+                    "Group size", min_value=1, value=min(2, max_group_size),
+                    max_value=max_group_size,
+                    key=f"group_size_{movie_id}"
+                )
+            with col2:
+                if st.button("Find Best Seats", icon=":material/auto_awesome:", key=f"best_seats_{movie_id}"):
+                    best_seats = handler.find_best_seats(movie_id, int(group_size), user_id=user_id)
+                    if best_seats and handler.hold_seats(user_id, movie_id, best_seats):
+                        for seat_id in st.session_state.selected_seats[movie_id]:
+                            st.session_state[f"seat_{seat_id}_{movie_id}"] = False
+                        for seat_id in best_seats:
+                            st.session_state[f"seat_{seat_id}_{movie_id}"] = True
+                        st.session_state.selected_seats[movie_id] = best_seats
+                        st.rerun()
+                    else:
+                        st.warning("No block of that many seats side by side is free.")
+        
         # Display seat grid
         st.markdown("#### Select Your Seats:")
         selected_seats = st.session_state.selected_seats[movie_id].copy()
         
+        # Create columns for each row - use the widest row plus row label
+        max_seats_in_row = seat_layout['seats_per_row'] or 10
         for row_index, row in enumerate(seat_grid):
-            # Create columns for the row - use max 10 seats plus row label
-            max_seats_in_row = max(len(r) for r in seat_grid) if seat_grid else 10
+            if row_index in sections:
+                st.markdown(f"##### {sections[row_index]}")
             cols = st.columns([1] + [1] * max_seats_in_row)  # Row label + seats
             
             # Row label
             with cols[0]:
-                st.markdown(f"**Row {chr(65 + row_index)}**")
+                st.markdown(f"**Row {seat_layout['row_labels'][row_index]}**")
             
             # Seats in this row
             for seat_index, seat_id in enumerate(row):
@@ -145,14 +177,24 @@ class CinemaGUI:
                         # Empty placeholder for consistent grid
                         st.markdown("&nbsp;")
                     else:
-                        is_booked = seat_id in seat_layout['booked_seats']
+                        position = positions[seat_id]
+                        is_booked = seat_layout['booked_mask'] >> position & 1
                         is_selected = seat_id in selected_seats
                         
-                        if is_booked:
+                        if seat_layout['blocked_mask'] >> position & 1:
+                            # Seat taken out of use by the theatre
+                            st.markdown("⬛")
+                            st.caption(f"{seat_id}")
+                        elif is_booked:
                             # Show booked seat (disabled)
                             st.markdown("🔴")
                             st.caption(f"{seat_id}")
                             st.caption("Booked")
+                        elif seat_layout['held_mask'] >> position & 1:
+                            # Held for another user who is booking right now
+                            st.markdown("🟠")
+                            st.caption(f"{seat_id}")
+                            st.caption("Held")
                         else:
                             # Show available seat with checkbox
                             checkbox_key = f"seat_{seat_id}_{movie_id}"
@@ -173,14 +215,24 @@ class CinemaGUI:
                             # Visual indicator
                             if checked:
                                 st.markdown("🟡")
+                            elif seat_layout['accessible_mask'] >> position & 1:
+                                st.markdown("♿")
                             else:
                                 st.markdown("🟢")
                             st.badge(f"{seat_id}", color="primary")
         
         if st.button("Cancel",icon=":material/cancel:", key=f"cancel_{movie_id},"):
+                    handler.release_user_holds(user_id, movie_id)
                     self.force_refresh_seat_data()
                     st.rerun()
         
+        # Hold the selected seats for this user until they book
+        if selected_seats != st.session_state.selected_seats[movie_id]:
+            if selected_seats and not handler.hold_seats(user_id, movie_id, selected_seats):
+                st.warning("Some of these seats were just taken by someone else.")
+            elif not selected_seats:
+                handler.release_user_holds(user_id, movie_id)
+        
         # Update session state
         st.session_state.selected_seats[movie_id] = selected_seats
         
@@ -218,6 +270,7 @@ class CinemaGUI:
             
             with col2:
                 if st.button("Clear Selection",icon=":material/delete:", key=f"clear_{movie_id}"):
+                    handler.release_user_holds(user_id, movie_id)
                     st.session_state.selected_seats[movie_id] = []
                     st.rerun()
         
@@ -229,13 +282,15 @@ class CinemaGUI:
         # Sidebar navigation
         page = st.sidebar.selectbox(
             "Navigation",
-            ["Add Movie/Showing", "Theatre Bookings"]
+            ["Add Movie/Showing", "Theatre Bookings", "Seat Layout"]
         )
         
         if page == "Add Movie/Showing":
             self.show_add_movie_page()
         elif page == "Theatre Bookings":
             self.show_theatre_bookings_page()
+        elif page == "Seat Layout":
+            self.show_seat_layout_page()
         
         if st.sidebar.button("Logout"):
             st.session_state.user = None
@@ -269,7 +324,7 @@ class CinemaGUI:
                     st.write(f"**Genre:** {movie['genre']}")
                     st.write(f"**Duration:** {movie['duration']} minutes")
                     st.write(f"**Showtime:** {movie['showtime']}")
-                    st.write(f"**Available Seats:** {movie['available_seats']}")
+                    st.write(f"**Available Seats:** {movie['available_seats']} of {movie['capacity']}")
                     st.write(f"**Price:** ${float(movie['price']):.2f} per seat")
                 with col2:
                     try:
@@ -281,7 +336,7 @@ class CinemaGUI:
                         st.write(f"🎬 {movie['title']}")
 
                 with col3:
-                    if int(movie['available_seats']) > 0:
+                    if not movie.sold_out:
                         # Visual seat selection button
                         if st.button(
                             "Select Seats", 
@@ -342,7 +397,8 @@ class CinemaGUI:
             genre = st.text_input("Genre")
             duration = st.number_input("Duration (minutes)", min_value=1, value=90)
             showtime = st.text_input("Showtime (HH:MM)")
-            seats = st.number_input("Number of Seats", min_value=1, value=50)
+            seats = st.number_input("Number of Seats", min_value=1, value=50,
+                                    help="Ignored if your theatre has a seat layout")
             price = st.number_input("Ticket Price ($)", min_value=0.0, value=10.0, step=0.5)
             image_url = st.text_input("Movie Poster URL", help="Enter the URL of the movie poster image")
             
@@ -368,8 +424,7 @@ class CinemaGUI:
         if not bookings:
             st.info("No bookings for your theatre")
         else:
-            # Calculate total revenue
-            total_revenue = sum(float(b['total_price']) for b in bookings)
+            total_revenue = float(handler.get_theatre_revenue(st.session_state.user['theatre_id']))
             st.metric("Total Revenue", f"${total_revenue:.2f}")
             
             for booking in bookings:
@@ -380,7 +435,36 @@ class CinemaGUI:
                     st.write(f"Total Price: ${float(booking['total_price']):.2f}")
                     st.write(f"Booking Date: {booking['booking_date'][:19]}")
 
+    def show_seat_layout_page(self):
+        st.header("Seat Layout")
+        st.caption(
+            "Rows are separated by '/', each a comma-separated run of cells: a count "
+            "followed by s (seat, default), a (aisle gap), x (blocked seat) or w "
+            "(accessible seat). Prefix a row with 'N*' to repeat it. "
+            "Example: 10*4,1a,12,1a,4/2w,1a,12,1a,2w"
+        )
+        
+        theatre_id = st.session_state.user['theatre_id']
+        current = handler.get_theatre_layout(theatre_id)
+        
+        with st.form("seat_layout_form"):
+            rows = st.text_area("Rows", value=current['rows'] if current else "")
+            sections = st.text_input(
+                "Sections", value=current['sections'] if current else "",
+                help="Named row ranges counted from 1, e.g. Stalls:1-10,Circle:11-14"
+            )
+            
+            if st.form_submit_button("Save Layout"):
+                if handler.set_theatre_layout(theatre_id, rows, sections):
+                    st.success("Seat layout saved!")
+                    st.rerun()
+                else:
+                    st.error("Invalid layout, or it has fewer seats than a showing has sold")
+
 def main():
+    # Tables are set up once per process, not on every rerun
+    handler.init()
+    
     # Set page configuration
     st.set_page_config(
         page_title="PVC Cinema Management",
@@ -1,60 +1,802 @@
-import csv
-import os
 import datetime
+import heapq
+import queue
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import lru_cache, partial, wraps
 from typing import List, Dict, Optional, Tuple
 from crypto import hash_password, verify_password
+import storage
+from layouts import LAYOUT_CACHE_SIZE, SEATS_PER_ROW, SeatLayout, parse_layout, uniform_layout
+from records import Hold, Record, format_cents
+from storage import CSV_HEADERS, INDEXED_FIELDS, PRIMARY_KEYS, to_records
 
-# Global configuration
-CSV_FILES = {
-    'movies_showings': 'movies_showings.csv',
-    'users': 'users.csv',
-    'admins': 'admins.csv',
-    'bookings': 'bookings.csv'
-}
-
-def _read_csv(file_key: str) -> List[Dict]:
-    """Read a CSV file and return list of dictionaries."""
-    data = []
-    with open(CSV_FILES[file_key], 'r', newline='') as f:
-        reader = csv.DictReader(f)
-        data = list(reader)
-    return data
-
-def _write_csv(file_key: str, data: List[Dict]):
-    """Write list of dictionaries to CSV file."""
-    headers = {
-        'movies_showings': ['id', 'title', 'genre', 'duration', 'theatre_id', 'showtime', 'available_seats', 'price', 'image_url'],
-        'users': ['user_id', 'username', 'password', 'salt', 'email', 'status'],
-        'admins': ['admin_id', 'username', 'password', 'salt', 'type', 'theatre_id'],
-        'bookings': ['booking_id', 'user_id', 'showing_id', 'seats_booked', 'seat_numbers', 'total_price', 'booking_date']
-    }
-    
-    with open(CSV_FILES[file_key], 'w', newline='') as f:
-        writer = csv.writer(f)
-        # Always write headers
-        writer.writerow(headers[file_key])
+# Backend the tables are stored in, see storage.open_backend
+_backend: Optional[storage.StorageBackend] = None
+
+# Storage is made ready (see init) on first use rather than on import:
+# None, 'running' while init runs, then 'done'. Guarded by _storage_lock.
+_init_state: Optional[str] = None
+
+# New primary keys are reserved from storage this many at a time
+ID_BLOCK_SIZE = 16
+
+# Reserved but unused primary keys: table -> [next id, end of block]
+_id_blocks: Dict[str, List[int]] = {}
+_id_lock = threading.Lock()
+
+# Tables kept in memory: table -> _Table
+_TABLE_CACHE: Dict[str, '_Table'] = {}
+
+# Serializes loading tables into the cache and writing to storage. Held only
+# while a table is loaded or written, never across a whole booking.
+_storage_lock = threading.RLock()
+
+# One lock per showing: bookings for the same showing run one at a time,
+# bookings for different showings in parallel
+_showing_locks: Dict[str, threading.RLock] = {}
+_showing_locks_guard = threading.Lock()
+
+# Times an operation is rerun when another process changed a table it read,
+# after a random pause of up to STALE_WRITE_BACKOFF_MS, doubling the first
+# few times
+STALE_WRITE_RETRIES = 10
+STALE_WRITE_BACKOFF_MS = 5
+
+# Per thread, while an operation runs: table -> (cached _Table, its
+# generation) when first read. Writes from this process change cached tables
+# in place, so the operation only has to start over if one has since taken
+# in another process's writes, or storage moved on without it.
+_operation = threading.local()
+
+# Bookings and cancellations are written by a single thread in batches: the
+# changes submitted within COMMIT_WINDOW_MS of the first in a batch, up to
+# COMMIT_BATCH_SIZE of them, are stored with one write per table
+COMMIT_WINDOW_MS = 2
+COMMIT_BATCH_SIZE = 256
+
+_commit_queue: 'queue.Queue[_Commit]' = queue.Queue()
+_committer: Optional[threading.Thread] = None
+_committer_guard = threading.Lock()
+
+# Seats a user has selected are held for them this long before booking
+HOLD_TTL_SECONDS = 300
+# Keep holds in the holds table instead of in memory, so they survive a
+# restart and hold seats against every process sharing the tables
+PERSIST_HOLDS = False
+
+# Live seat holds: hold id -> Hold, and showing id -> {hold id: Hold}
+_holds: Dict[str, Hold] = {}
+_showing_holds: Dict[str, Dict[str, Hold]] = {}
+# (expires_at, hold id) heap; entries of holds already gone are skipped
+_hold_expiry: List[Tuple[int, str]] = []
+_hold_lock = threading.RLock()
+# With PERSIST_HOLDS: the cached holds table and its generation and
+# signature when the live holds were last built from it
+_holds_source: Optional[tuple] = None
+
+class _ReadWriteLock:
+    """Lets many readers in at once, or one writer alone.
+    
+    Writers are preferred: once one is waiting, new readers queue up behind
+    it, so a steady stream of readers cannot hold writers off. Not reentrant.
+    """
+    
+    def __init__(self):
+        self._changed = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+    
+    @contextmanager
+    def read(self):
+        with self._changed:
+            while self._writing or self._writers_waiting:
+                self._changed.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._readers -= 1
+                if not self._readers:
+                    self._changed.notify_all()
+    
+    @contextmanager
+    def write(self):
+        with self._changed:
+            self._writers_waiting += 1
+            try:
+                while self._writing or self._readers:
+                    self._changed.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._writing = False
+                self._changed.notify_all()
+
+# Guards the rows of cached tables: reads copy rows out under the read lock,
+# writes change them under the write lock once storage has the change
+_cache_lock = _ReadWriteLock()
+
+class _Table:
+    """Cached copy of a stored table, with its rows indexed by primary key
+    and by the columns in INDEXED_FIELDS.
+    
+    For bookings it also keeps projections of the bookings log: the seats
+    booked and the seats sold and revenue of each showing, which are where
+    availability comes from.
+    """
+    
+    def __init__(self, name: str, signature, rows: List[Record]):
+        self.name = name
+        self.signature = signature
+        # Bumped whenever rows written by another process are caught up with
+        self.generation = 0
+        key = PRIMARY_KEYS[name]
+        # Dicts keep insertion order, so this doubles as the row list
+        self.by_id: Dict[str, Record] = {row[key]: row for row in rows}
+        # field -> value -> {primary key: row}
+        self.indexes: Dict[str, Dict[str, Dict[str, Record]]] = {
+            field: {} for field in INDEXED_FIELDS.get(name, ())
+        }
+        # Bookings only: showing id -> [seat layout, bitset of booked seats],
+        # built on first use and then kept up to date along with the indexes
+        self.seat_maps: Dict[str, list] = {}
+        # Bookings only: showing id -> [seats sold, revenue in cents]
+        self.sales: Optional[Dict[str, List[int]]] = {} if name == 'bookings' else None
+        for row in self.by_id.values():
+            self._index(row)
+    
+    def rows(self):
+        return self.by_id.values()
+    
+    def lookup(self, field: str, value: str):
+        """Return the rows whose indexed field equals value."""
+        return self.indexes[field].get(value, {}).values()
+    
+    def seat_map(self, showing_id: str, layout: SeatLayout) -> int:
+        """Return the bitset of seats booked for a showing, by position in layout."""
+        entry = self.seat_maps.get(showing_id)
+        if entry is None or entry[0] is not layout:
+            bits = 0
+            for booking in self.lookup('showing_id', showing_id):
+                bits |= layout.booked_bits(booking.seat_numbers)
+            entry = self.seat_maps[showing_id] = [layout, bits]
+        return entry[1]
+    
+    def with_changes(self, inserted: List[Record], updated: List[Record],
+                     deleted: List[str]) -> List[Record]:
+        """Return the rows as they will be once apply is called, leaving these alone."""
+        key = PRIMARY_KEYS[self.name]
+        rows = dict(self.by_id)
+        for row in inserted:
+            rows[row[key]] = row
+        for row in updated:
+            if row[key] in rows:
+                rows[row[key]] = row
+        for row_id in deleted:
+            rows.pop(row_id, None)
+        return list(rows.values())
+    
+    def apply(self, inserted: List[Record], updated: List[Record], deleted: List[str]):
+        """Apply row changes to the cached rows and their indexes."""
+        key = PRIMARY_KEYS[self.name]
+        for row in inserted:
+            self._unindex(self.by_id.get(row[key]))
+            self.by_id[row[key]] = row
+            self._index(row)
+        for row in updated:
+            if row[key] in self.by_id:
+                self._unindex(self.by_id[row[key]])
+                self.by_id[row[key]] = row
+                self._index(row)
+        for row_id in deleted:
+            self._unindex(self.by_id.pop(row_id, None))
+    
+    def _index(self, row: Record):
+        row_id = row[PRIMARY_KEYS[self.name]]
+        for field, index in self.indexes.items():
+            index.setdefault(row[field], {})[row_id] = row
+        entry = self.seat_maps.get(row['showing_id']) if self.seat_maps else None
+        if entry is not None:
+            entry[1] |= entry[0].booked_bits(row.seat_numbers)
+        if self.sales is not None:
+            sales = self.sales.setdefault(row['showing_id'], [0, 0])
+            sales[0] += row.seats_booked or 0
+            sales[1] += row.total_price_cents or 0
+    
+    def _unindex(self, row: Optional[Record]):
+        if row is None:
+            return
+        row_id = row[PRIMARY_KEYS[self.name]]
+        for field, index in self.indexes.items():
+            matches = index.get(row[field])
+            if matches is not None:
+                matches.pop(row_id, None)
+                if not matches:
+                    del index[row[field]]
+        entry = self.seat_maps.get(row['showing_id']) if self.seat_maps else None
+        if entry is not None:
+            # Bookings never share seats, so this frees exactly this booking's seats
+            entry[1] &= ~entry[0].booked_bits(row.seat_numbers)
+        if self.sales is not None:
+            sales = self.sales[row['showing_id']]
+            sales[0] -= row.seats_booked or 0
+            sales[1] -= row.total_price_cents or 0
+
+def _storage() -> storage.StorageBackend:
+    """Return the configured storage backend, creating it and running init on first use."""
+    global _backend
+    if _backend is None:
+        _backend = storage.open_backend()
+    if _init_state != 'done':
+        init()
+    return _backend
+
+def init():
+    """Make storage ready: create missing tables with the example data and
+    finish writes a crash interrupted. Runs once per process, on the first
+    call or the first use of storage, whichever comes first."""
+    global _init_state
+    # _storage() runs this while holding _storage_lock, and init's own reads
+    # take it too, so that is the one lock to wait for
+    with _storage_lock:
+        # Also reached from inside, through the storage it uses
+        if _init_state is not None:
+            return
+        _init_state = 'running'
+        try:
+            ensure_csv_files_exist()
+        except BaseException:
+            _init_state = None
+            raise
+        _init_state = 'done'
+
+def use_storage(backend: storage.StorageBackend):
+    """Switch to another storage backend, e.g. a SQLiteBackend after migrating."""
+    global _backend
+    _backend = backend
+    clear_table_cache()
+    with _id_lock:
+        _id_blocks.clear()
+
+def clear_table_cache():
+    """Drop all cached tables so the next read goes back to storage."""
+    _TABLE_CACHE.clear()
+
+def _load_table(table: str) -> _Table:
+    """Return the cached table, reloading it if the stored table changed.
+    
+    For writers, which must hold _storage_lock while they use the result.
+    """
+    with _storage_lock:
+        backend = _storage()
+        cached = _TABLE_CACHE.get(table)
+        if cached is not None and backend.signature(table) != cached.signature:
+            # Appended to by another process: read just the new rows if possible
+            tail = backend.load_since(table, cached.signature)
+            if tail is not None:
+                signature, rows, deleted = tail
+                with _cache_lock.write():
+                    cached.apply(rows, [], deleted)
+                    cached.signature = signature
+                    cached.generation += 1
+            else:
+                cached = None
+        if cached is None:
+            signature, rows = backend.load(table)
+            cached = _TABLE_CACHE[table] = _Table(table, signature, rows)
+        _note_read(table, cached)
+        return cached
+
+def _note_read(table: str, cached: _Table):
+    """Remember the cached table the running operation first read."""
+    reads = getattr(_operation, 'reads', None)
+    if reads is not None and table not in reads:
+        reads[table] = (cached, cached.generation)
+
+def _changed_since(table: str, read: Tuple[_Table, int]) -> bool:
+    """Tell whether another process changed table since it was read."""
+    cached, generation = read
+    return _TABLE_CACHE.get(table) is not cached or cached.generation != generation
+
+def _stale_table(reads: Dict[str, Tuple[_Table, int]]) -> Optional[str]:
+    """Return a table read by an operation that changed since, other than
+    through this process, or None. Callers hold _storage_lock."""
+    backend = _storage()
+    for table, read in reads.items():
+        if _changed_since(table, read) or backend.signature(table) != read[0].signature:
+            return table
+    return None
+
+def _retry_stale(func):
+    """Rerun an operation that writes from scratch when a table it read was
+    changed by another process before its write, up to STALE_WRITE_RETRIES times.
+    
+    Only the outermost decorated call retries; nested ones join its reads.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_operation, 'reads', None) is not None:
+            return func(*args, **kwargs)
+        try:
+            for attempt in range(STALE_WRITE_RETRIES + 1):
+                _operation.reads = {}
+                try:
+                    return func(*args, **kwargs)
+                except storage.StaleWriteError:
+                    if attempt == STALE_WRITE_RETRIES:
+                        raise
+                # Keep processes that collided from colliding again
+                time.sleep(random.uniform(0, STALE_WRITE_BACKOFF_MS << min(attempt, 4)) / 1000)
+        finally:
+            _operation.reads = None
+    return wrapper
+
+def _snapshot(table: str) -> _Table:
+    """Return the cached table for a read, reloading it first if storage changed.
+    
+    Never waits behind a write in progress: while another thread holds
+    _storage_lock, the cached table is returned as it is, with every write
+    this process has finished. Take _cache_lock.read() afterwards, for as
+    long as the result is used.
+    """
+    cached = _TABLE_CACHE.get(table)
+    if _storage_lock.acquire(blocking=cached is None):
+        try:
+            cached = _load_table(table)
+        finally:
+            _storage_lock.release()
+    return cached
+
+def _table_rows(table: str) -> List[Record]:
+    """Return the cached rows of a table for read-only scans.
+    
+    The rows are shared with the cache and must not be modified.
+    """
+    cached = _snapshot(table)
+    with _cache_lock.read():
+        _note_read(table, cached)
+        return list(cached.rows())
+
+def _read_table(table: str) -> List[Record]:
+    """Read a table and return list of records.
+    
+    Rows are served from memory until the stored table changes. Callers
+    always get their own copies, so modifying them never touches the cache.
+    """
+    cached = _snapshot(table)
+    with _cache_lock.read():
+        _note_read(table, cached)
+        return [row.copy() for row in cached.rows()]
+
+def _find_rows(table: str, field: str, value: str) -> List[Record]:
+    """Return copies of the rows of a table whose field equals value."""
+    cached = _TABLE_CACHE.get(table)
+    if _storage_lock.acquire(blocking=cached is None):
+        try:
+            # Operations that write read through the cache, which tracks changes
+            if getattr(_operation, 'reads', None) is None and (
+                    cached is None or _storage().signature(table) != cached.signature):
+                # Not worth loading the whole table if the backend has an index
+                rows = _storage().find(table, field, value)
+                if rows is not None:
+                    return rows
+            cached = _load_table(table)
+        finally:
+            _storage_lock.release()
+    
+    with _cache_lock.read():
+        _note_read(table, cached)
+        if field == PRIMARY_KEYS[table]:
+            row = cached.by_id.get(value)
+            return [row.copy()] if row is not None else []
+        if field in cached.indexes:
+            return [row.copy() for row in cached.lookup(field, value)]
+        return [row.copy() for row in cached.rows() if row[field] == value]
+
+def _indexed_rows(table: str, field: str, value: str) -> List[Record]:
+    """Return the cached rows whose indexed field equals value, for read-only use."""
+    cached = _snapshot(table)
+    with _cache_lock.read():
+        _note_read(table, cached)
+        return list(cached.lookup(field, value))
+
+@contextmanager
+def _lock_showings(*showing_ids: str):
+    """Serialize work on the given showings against other work on them.
+    
+    Locks are taken in a fixed order, so callers locking several showings
+    cannot deadlock each other.
+    """
+    with _showing_locks_guard:
+        locks = [_showing_locks.setdefault(showing_id, threading.RLock())
+                 for showing_id in sorted(set(map(str, showing_ids)))]
+    for lock in locks:
+        lock.acquire()
+    try:
+        yield
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+def _showing_layout(showing: Record) -> SeatLayout:
+    """Return the seat layout of a showing's theatre, or rows of SEATS_PER_ROW
+    seats if the theatre has none."""
+    layouts = _snapshot('layouts')
+    with _cache_lock.read():
+        _note_read('layouts', layouts)
+        layout = layouts.by_id.get(showing.theatre_id)
+    if layout is not None:
+        return parse_layout(layout.rows, layout.sections)
+    
+    total_seats = showing.capacity
+    if total_seats is None:
+        # Not backfilled yet, count the booked seats
+        bookings = _indexed_rows('bookings', 'showing_id', showing['id'])
+        total_seats = showing.available_seats + sum(b.seats_booked for b in bookings)
+    return uniform_layout(total_seats)
+
+def _booked_seat_map(showing: Record, layout: SeatLayout) -> int:
+    """Return the bitset of seats booked for a showing."""
+    bookings = _snapshot('bookings')
+    with _cache_lock.read():
+        _note_read('bookings', bookings)
+        return bookings.seat_map(showing['id'], layout)
+
+def _with_sales(showings: List[Record]) -> List[Record]:
+    """Set available_seats of showing copies from the bookings.
+    
+    The bookings log is the record of what was sold; the available_seats
+    stored with a showing is only refreshed when the showing is saved.
+    Showings stored before capacity was a column keep their stored count.
+    Until the bookings are cached, the seats sold come from the backend's
+    totals, without loading them, unless an operation needs its reads tracked.
+    """
+    sold = None
+    if 'bookings' not in _TABLE_CACHE and getattr(_operation, 'reads', None) is None:
+        sold = _storage().totals('bookings')
+    if sold is not None:
+        for showing in showings:
+            if showing.capacity is not None:
+                showing.available_seats = showing.capacity - sold.get(showing['id'], 0)
+        return showings
+    
+    bookings = _snapshot('bookings')
+    with _cache_lock.read():
+        _note_read('bookings', bookings)
+        for showing in showings:
+            if showing.capacity is not None:
+                sales = bookings.sales.get(showing['id'])
+                showing.available_seats = showing.capacity - (sales[0] if sales else 0)
+    return showings
+
+def _get_showing(showing_id: str) -> Optional[Record]:
+    """Return a copy of a showing with its seats available worked out, or None."""
+    showing = _get_row('movies_showings', showing_id)
+    return _with_sales([showing])[0] if showing else None
+
+# Seat holds
+
+def _sync_holds():
+    """With PERSIST_HOLDS, rebuild the live holds from the cached holds table
+    whenever it changed, which takes in holds written by other processes."""
+    global _holds_source
+    if not PERSIST_HOLDS:
+        return
+    cached = _snapshot('holds')
+    with _cache_lock.read():
+        _note_read('holds', cached)
+        source = (cached, cached.generation, cached.signature)
+        if source == _holds_source:
+            return
+        holds = [hold.copy() for hold in cached.rows()]
+    _holds.clear()
+    _showing_holds.clear()
+    _hold_expiry.clear()
+    for hold in holds:
+        _holds[hold.hold_id] = hold
+        _showing_holds.setdefault(hold.showing_id, {})[hold.hold_id] = hold
+        _hold_expiry.append((hold.expires_at, hold.hold_id))
+    heapq.heapify(_hold_expiry)
+    _holds_source = source
+
+def _add_hold(hold: Hold):
+    _holds[hold.hold_id] = hold
+    _showing_holds.setdefault(hold.showing_id, {})[hold.hold_id] = hold
+    heapq.heappush(_hold_expiry, (hold.expires_at, hold.hold_id))
+
+def _user_holds(user_id: str, showing_id: Optional[str] = None) -> List[str]:
+    _sync_holds()
+    return [hold.hold_id for hold in _holds.values()
+            if hold.user_id == str(user_id) and (showing_id is None or hold.showing_id == str(showing_id))]
+
+def _forget_holds(hold_ids: List[str]) -> List[str]:
+    dropped = []
+    for hold_id in hold_ids:
+        hold = _holds.pop(hold_id, None)
+        if hold is not None:
+            holds = _showing_holds[hold.showing_id]
+            del holds[hold_id]
+            if not holds:
+                del _showing_holds[hold.showing_id]
+            dropped.append(hold_id)
+    return dropped
+
+def _drop_holds(hold_ids: List[str]):
+    dropped = _forget_holds(hold_ids)
+    if PERSIST_HOLDS and dropped:
+        _save_rows('holds', deleted=dropped)
+
+@_retry_stale
+def _expire_holds():
+    """Drop holds whose time is up, oldest first off the expiry heap."""
+    _sync_holds()
+    now = time.time()
+    expired = []
+    while _hold_expiry and _hold_expiry[0][0] <= now:
+        _, hold_id = heapq.heappop(_hold_expiry)
+        expired.append(hold_id)
+    _drop_holds(expired)
+
+def _held_seat_map(showing_id: str, layout: SeatLayout, user_id: Optional[str] = None) -> int:
+    """Return the bitset of seats held for a showing, except by user_id."""
+    with _hold_lock:
+        _expire_holds()
+        bits = 0
+        for hold in _showing_holds.get(str(showing_id), {}).values():
+            if hold.user_id != user_id:
+                bits |= layout.booked_bits(hold.seat_numbers)
+        return bits
+
+@_retry_stale
+def hold_seats(user_id: str, showing_id: str, seats: List[str],
+               ttl: Optional[int] = None) -> Optional[str]:
+    """Hold seats for a user for ttl seconds (HOLD_TTL_SECONDS by default).
+    
+    The hold replaces any the user already has on the showing. Returns the
+    hold id, or None if a seat is invalid, booked or held by someone else.
+    An empty seat list just releases the user's holds.
+    """
+    user_id, showing_id = str(user_id), str(showing_id)
+    with _lock_showings(showing_id):
+        showing = _get_row('movies_showings', showing_id)
+        if not showing:
+            return None
+        layout = _showing_layout(showing)
         
-        # Write data rows if any exist
-        if data:
-            dict_writer = csv.DictWriter(f, fieldnames=headers[file_key])
-            dict_writer.writerows(data)
+        with _hold_lock:
+            requested = layout.mask(seats)
+            taken = _booked_seat_map(showing, layout) | _held_seat_map(showing_id, layout, user_id)
+            if requested is None or taken & requested:
+                return None
+            release_user_holds(user_id, showing_id)
+            if not requested:
+                return None
+            
+            hold = Hold(uuid.uuid4().hex, user_id, showing_id, ','.join(seats),
+                        int(time.time() + (HOLD_TTL_SECONDS if ttl is None else ttl)))
+            _add_hold(hold)
+            if PERSIST_HOLDS:
+                _save_rows('holds', inserted=[hold.copy()])
+            return hold.hold_id
+
+@_retry_stale
+def release_hold(hold_id: str) -> bool:
+    """Release a hold before it expires."""
+    with _hold_lock:
+        _sync_holds()
+        if hold_id not in _holds:
+            return False
+        _drop_holds([hold_id])
+        return True
+
+@_retry_stale
+def release_user_holds(user_id: str, showing_id: Optional[str] = None):
+    """Release a user's holds, on one showing or on all of them."""
+    with _hold_lock:
+        _drop_holds(_user_holds(user_id, showing_id))
+
+def _save_booking(booking: Dict):
+    """Store a booking, releasing the user's holds on its showing in the same write.
+    
+    Raises storage.StaleWriteError, storing neither, if the bookings or holds
+    changed since the running operation read them.
+    """
+    with _hold_lock:
+        held = _user_holds(booking['user_id'], booking['showing_id'])
+        changes = {'bookings': ([booking], [], [])}
+        if PERSIST_HOLDS and held:
+            changes['holds'] = ([], [], held)
+        _submit(changes).result()
+        _forget_holds(held)
+
+def _get_row(table: str, row_id: str) -> Optional[Record]:
+    """Return a copy of the row with the given primary key, or None."""
+    rows = _find_rows(table, PRIMARY_KEYS[table], str(row_id))
+    return rows[0] if rows else None
+
+def _next_id(table: str) -> str:
+    """Hand out a new primary key for table.
+    
+    Keys come from a per-table sequence kept by the storage backend, which
+    reserves them in blocks of ID_BLOCK_SIZE so most calls never touch storage.
+    Keys only ever grow, but unused ones are skipped when a process exits.
+    """
+    with _id_lock:
+        block = _id_blocks.get(table)
+        if block is None or block[0] >= block[1]:
+            start = _storage().reserve_ids(table, ID_BLOCK_SIZE)
+            block = _id_blocks[table] = [start, start + ID_BLOCK_SIZE]
+        row_id = block[0]
+        block[0] += 1
+    return str(row_id)
+
+def _save_rows(table: str, inserted: List[Dict] = (), updated: List[Dict] = (),
+               deleted: List[str] = ()):
+    """Persist row changes and apply them to the cached copy of the table.
+    
+    Rows may be records or dicts of column values. updated rows replace the
+    stored rows with the same primary key, deleted lists primary keys of rows
+    to remove. Raises storage.StaleWriteError if the table changed in storage
+    since the running operation read it.
+    """
+    _save_tables({table: (inserted, updated, deleted)})
+
+def _save_tables(changes: Dict[str, Tuple[List[Dict], List[Dict], List[str]]]):
+    """Like _save_rows for (inserted, updated, deleted) changes to several
+    tables, which are stored all together or not at all."""
+    prepared = {}
+    for table, (inserted, updated, deleted) in changes.items():
+        inserted = to_records(table, inserted)
+        updated = to_records(table, updated)
+        deleted = [str(row_id) for row_id in deleted]
+        if inserted or updated or deleted:
+            prepared[table] = (inserted, updated, deleted)
+    if not prepared:
+        return
+    
+    with _storage_lock:
+        reads = getattr(_operation, 'reads', None) or {}
+        tables = {}
+        for table in prepared:
+            tables[table] = _load_table(table)
+            if table in reads and _changed_since(table, reads[table]):
+                raise storage.StaleWriteError(table)
+        try:
+            if len(prepared) == 1:
+                (table, (inserted, updated, deleted)), = prepared.items()
+                signatures = {table: _storage().write_changes(
+                    table, tables[table].signature, inserted, updated, deleted,
+                    partial(tables[table].with_changes, inserted, updated, deleted))}
+            else:
+                signatures = _storage().write_batch({
+                    table: (tables[table].signature, inserted, updated, deleted,
+                            partial(tables[table].with_changes, inserted, updated, deleted))
+                    for table, (inserted, updated, deleted) in prepared.items()
+                })
+        except BaseException:
+            # Storage may be half written, reload on next read
+            for table in prepared:
+                _TABLE_CACHE.pop(table, None)
+            raise
+        # Readers only see the changes once they are stored, all at once
+        with _cache_lock.write():
+            for table, (inserted, updated, deleted) in prepared.items():
+                tables[table].apply(inserted, updated, deleted)
+                tables[table].signature = signatures[table]
+
+@contextmanager
+def _transaction():
+    """Keep other writers, in this process or others, out of storage while the
+    enclosed writes run; SQLite also commits them together. _save_tables
+    stores changes to several tables all or none on any backend.
+    
+    Takes _storage_lock first, so a database write lock is never waited for
+    while holding it. Once other writers are locked out, raises
+    storage.StaleWriteError if a table the running operation read has changed.
+    """
+    try:
+        with _storage_lock, _storage().transaction():
+            stale = _stale_table(getattr(_operation, 'reads', None) or {})
+            if stale is not None:
+                raise storage.StaleWriteError(stale)
+            yield
+    except BaseException:
+        # The cache may hold writes that were rolled back
+        clear_table_cache()
+        raise
+
+class _Commit:
+    """Row changes submitted to the committer thread, by table, with the
+    tables the submitting operation read and the future it waits on."""
+    __slots__ = ('changes', 'reads', 'future')
+    
+    def __init__(self, changes: Dict[str, Tuple[List[Dict], List[Dict], List[str]]],
+                 reads: Dict[str, Tuple[_Table, int]]):
+        self.changes = changes
+        self.reads = reads
+        self.future = Future()
 
+def _submit(changes: Dict[str, Tuple[List[Dict], List[Dict], List[str]]]) -> Future:
+    """Queue (inserted, updated, deleted) row changes by table for the committer.
+    
+    They are stored together, in one transaction with the rest of their
+    batch. The future's result is None once they are, or it raises
+    storage.StaleWriteError if a table the running operation read changed.
+    Must not be called while holding _storage_lock.
+    """
+    global _committer
+    commit = _Commit(changes, dict(getattr(_operation, 'reads', None) or {}))
+    with _committer_guard:
+        if _committer is None or not _committer.is_alive():
+            _committer = threading.Thread(target=_run_committer, name='pvc-committer', daemon=True)
+            _committer.start()
+    _commit_queue.put(commit)
+    return commit.future
+
+def _run_committer():
+    while True:
+        batch = [_commit_queue.get()]
+        deadline = time.monotonic() + COMMIT_WINDOW_MS / 1000
+        while len(batch) < COMMIT_BATCH_SIZE:
+            try:
+                batch.append(_commit_queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        _write_batch(batch)
+
+def _write_batch(batch: List[_Commit]):
+    """Store a batch of commits, one write per table, and resolve their futures."""
+    try:
+        with _transaction():
+            merged: Dict[str, Tuple[list, list, list]] = {}
+            committed = []
+            for commit in batch:
+                stale = _stale_table(commit.reads)
+                if stale is not None:
+                    commit.future.set_exception(storage.StaleWriteError(stale))
+                    continue
+                for table, changes in commit.changes.items():
+                    for rows, more in zip(merged.setdefault(table, ([], [], [])), changes):
+                        rows.extend(more)
+                committed.append(commit)
+            _save_tables(merged)
+    except BaseException as error:
+        for commit in batch:
+            if not commit.future.done():
+                commit.future.set_exception(error)
+        if not isinstance(error, Exception):
+            raise
+    else:
+        for commit in committed:
+            commit.future.set_result(None)
+
+def compact_bookings() -> int:
+    """Drop cancelled bookings from storage for good. Returns rows dropped."""
+    with _storage_lock:
+        cached = _load_table('bookings')
+        return _storage().compact('bookings', lambda: list(cached.rows()))
+
+@_retry_stale
 def ensure_csv_files_exist():
-    """Initialize CSV files with headers and example data if they don't exist."""
-    headers = {
-        'movies_showings': ['id', 'title', 'genre', 'duration', 'theatre_id', 'showtime', 'available_seats', 'price', 'image_url'],
-        'users': ['user_id', 'username', 'password', 'salt', 'email', 'status'],
-        'admins': ['admin_id', 'username', 'password', 'salt', 'type', 'theatre_id'],
-        'bookings': ['booking_id', 'user_id', 'showing_id', 'seats_booked', 'seat_numbers', 'total_price', 'booking_date']
-    }
-    
+    """Initialize tables with headers and example data if they don't exist."""
     # Example data to populate when creating new files
     example_data = {
         'movies_showings': [
-            ['1', 'Oppenheimer', 'Biography/Drama', '180', '1', '19:00', '120', '15.00', 'https://m.media-amazon.com/images/M/MV5BMDBmYTZjNjUtN2M1MS00MTQ2LTk2ODgtNzc2M2QyZGE5NTVjXkEyXkFqcGdeQXVyNzAwMjU2MTY@._V1_SX300.jpg'],
-            ['2', 'Lokah Chapter 1: Chandra', 'Drama', '140', '1', '17:30', '80', '12.00', 'https://m.media-amazon.com/images/M/MV5BNjI2MGFkMTgtODJmMC00MjhmLTk2ZWEtYjczMTEzMzhkNzg5XkEyXkFqcGc@._V1_.jpg'],
-            ['3', 'Demon Slayer: Infinity Castle', 'Anime/Action', '117', '2', '20:30', '150', '10.00', 'https://upload.wikimedia.org/wikipedia/en/thumb/a/ae/Kimetsu_No_Yaiba_Mugen_Jyo-hen_theatrical_poster.jpg/250px-Kimetsu_No_Yaiba_Mugen_Jyo-hen_theatrical_poster.jpg'],
-            ['4', 'La La Land', 'Romance/Musical', '128', '2', '18:45', '100', '13.00', 'https://m.media-amazon.com/images/M/MV5BMzUzNDM2NzM2MV5BMl5BanBnXkFtZTgwNTM3NTg4OTE@._V1_SX300.jpg']
+            ['1', 'Oppenheimer', 'Biography/Drama', '180', '1', '19:00', '120', '15.00', 'https://m.media-amazon.com/images/M/MV5BMDBmYTZjNjUtN2M1MS00MTQ2LTk2ODgtNzc2M2QyZGE5NTVjXkEyXkFqcGdeQXVyNzAwMjU2MTY@._V1_SX300.jpg', '120'],
+            ['2', 'Lokah Chapter 1: Chandra', 'Drama', '140', '1', '17:30', '80', '12.00', 'https://m.media-amazon.com/images/M/MV5BNjI2MGFkMTgtODJmMC00MjhmLTk2ZWEtYjczMTEzMzhkNzg5XkEyXkFqcGc@._V1_.jpg', '80'],
+            ['3', 'Demon Slayer: Infinity Castle', 'Anime/Action', '117', '2', '20:30', '150', '10.00', 'https://upload.wikimedia.org/wikipedia/en/thumb/a/ae/Kimetsu_No_Yaiba_Mugen_Jyo-hen_theatrical_poster.jpg/250px-Kimetsu_No_Yaiba_Mugen_Jyo-hen_theatrical_poster.jpg', '150'],
+            ['4', 'La La Land', 'Romance/Musical', '128', '2', '18:45', '100', '13.00', 'https://m.media-amazon.com/images/M/MV5BMzUzNDM2NzM2MV5BMl5BanBnXkFtZTgwNTM3NTg4OTE@._V1_SX300.jpg', '100']
         ],
         'users': [
             # Regular user - username: demo, password: demo
@@ -72,31 +814,38 @@ def ensure_csv_files_exist():
             # Theatre admin for theatre 2 - username: theatre2, password: theatre2
             ['3', 'theatre2', 'a7014bc186c29cf0c2b5fd00250310fb2ad30f919600390b58fdcdbb471dc585', '372e733eab5eb9716a31478d545de037', 'theatre', '2']
         ],
-        'bookings': []
+        'bookings': [],
+        'layouts': [],
+        'holds': []
     }
     
-    for file_key, filename in CSV_FILES.items():
-        if not os.path.exists(filename):
-            with open(filename, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(headers[file_key])
-                # Add example data if available for this file type
-                if file_key in example_data:
-                    writer.writerows(example_data[file_key])
+    _storage().create_missing({
+        table: [dict(zip(CSV_HEADERS[table], row)) for row in rows]
+        for table, rows in example_data.items()
+    })
+    _backfill_capacity()
 
+def _backfill_capacity():
+    """Fill in the capacity of showings stored before it was a column: the
+    seats still available plus the seats booked."""
+    showings = [showing.copy() for showing in _table_rows('movies_showings') if showing.capacity is None]
+    for showing in showings:
+        booked = _indexed_rows('bookings', 'showing_id', showing['id'])
+        showing.capacity = showing.available_seats + sum(b.seats_booked for b in booked)
+    _save_rows('movies_showings', updated=showings)
+
+@_retry_stale
 def register_user(username: str, password: str, email: str) -> bool:
     """Register a new user."""
-    users = _read_csv('users')
-    
     # Check if username or email already exists
-    if any(u['username'] == username or u['email'] == email for u in users):
+    if _find_rows('users', 'username', username) or _find_rows('users', 'email', email):
         return False
     
     # Hash password
     hashed_pass, salt = hash_password(password)
     
     # Generate new user ID
-    user_id = str(max([int(u['user_id']) for u in users], default=0) + 1)
+    user_id = _next_id('users')
     
     new_user = {
         'user_id': user_id,
@@ -107,14 +856,13 @@ def register_user(username: str, password: str, email: str) -> bool:
         'status': 'active'
     }
     
-    users.append(new_user)
-    _write_csv('users', users)
+    _save_rows('users', inserted=[new_user])
     return True
 
 def authenticate_user(username: str, password: str) -> Tuple[bool, Optional[Dict]]:
     """Authenticate a user or admin."""
     # Check users first
-    users = _read_csv('users')
+    users = _find_rows('users', 'username', username)
     for user in users:
         if user['username'] == username:
             # Check if user is banned
@@ -124,7 +872,7 @@ def authenticate_user(username: str, password: str) -> Tuple[bool, Optional[Dict
                 return True, {'type': 'user', 'id': user['user_id']}
     
     # Check admins
-    admins = _read_csv('admins')
+    admins = _find_rows('admins', 'username', username)
     for admin in admins:
         if admin['username'] == username:
             if verify_password(password, admin['password'], admin['salt']):
@@ -133,20 +881,23 @@ def authenticate_user(username: str, password: str) -> Tuple[bool, Optional[Dict
     
     return False, None
 
-def get_movies_showings(theatre_id: Optional[str] = None) -> List[Dict]:
+def get_movies_showings(theatre_id: Optional[str] = None) -> List[Record]:
     """Get all movies and showings, optionally filtered by theatre."""
-    movies = _read_csv('movies_showings')
     if theatre_id:
-        return [m for m in movies if m['theatre_id'] == theatre_id]
-    return movies
+        return _with_sales(_find_rows('movies_showings', 'theatre_id', theatre_id))
+    return _with_sales(_read_table('movies_showings'))
 
+@_retry_stale
 def add_movie_showing(title: str, genre: str, duration: int, 
                      theatre_id: str, showtime: str, seats: int, price: float) -> bool:
-    """Add a new movie showing."""
-    movies = _read_csv('movies_showings')
+    """Add a new movie showing. Theatres with a seat layout use its capacity
+    instead of seats."""
+    layout = get_theatre_layout(theatre_id)
+    if layout is not None:
+        seats = parse_layout(layout.rows, layout.sections).capacity
     
     # Generate new ID
-    movie_id = str(max([int(m['id']) for m in movies], default=0) + 1)
+    movie_id = _next_id('movies_showings')
     
     new_movie = {
         'id': movie_id,
@@ -157,268 +908,282 @@ def add_movie_showing(title: str, genre: str, duration: int,
         'showtime': showtime,
         'available_seats': str(seats),
         'price': str(price),
-        'image_url': ''
+        'image_url': '',
+        'capacity': str(seats)
     }
     
-    movies.append(new_movie)
-    _write_csv('movies_showings', movies)
+    _save_rows('movies_showings', inserted=[new_movie])
     return True
 
+@_retry_stale
 def book_tickets(user_id: str, showing_id: str, seat_numbers: List[str]) -> Optional[str]:
     """Book tickets for a showing."""
-    movies = _read_csv('movies_showings')
-    bookings = _read_csv('bookings')
-    
-    # Find the showing
-    showing = None
-    for m in movies:
-        if m['id'] == showing_id:
-            showing = m
-            break
-    
-    if not showing:
-        return None
-    
-    # Check if seats are available
-    available_seats = int(showing['available_seats'])
-    if available_seats < len(seat_numbers):
-        return None
-    
-    # Check if seats are already booked
-    existing_bookings = [b for b in bookings if b['showing_id'] == showing_id]
-    booked_seats = []
-    for booking in existing_bookings:
-        booked_seats.extend(booking['seat_numbers'].split(','))
-    
-    if any(seat in booked_seats for seat in seat_numbers):
-        return None
-    
-    # Create booking
-    booking_id = str(max([int(b['booking_id']) for b in bookings], default=0) + 1)
-    total_price = len(seat_numbers) * float(showing['price'])
-    
-    new_booking = {
-        'booking_id': booking_id,
-        'user_id': user_id,
-        'showing_id': showing_id,
-        'seats_booked': str(len(seat_numbers)),
-        'seat_numbers': ','.join(seat_numbers),
-        'total_price': str(total_price),
-        'booking_date': datetime.datetime.now().isofor()
-    }
-    
-    # Update available seats
-    showing['available_seats'] = str(available_seats - len(seat_numbers))
-    
-    # Save changes
-    bookings.append(new_booking)
-    _write_csv('bookings', bookings)
-    _write_csv('movies_showings', movies)
-    
-    return booking_id
+    with _lock_showings(showing_id):
+        # Find the showing
+        showing = _get_showing(showing_id)
+        if not showing:
+            return None
+        
+        # Check if seats are available
+        available_seats = showing.available_seats
+        if available_seats < len(seat_numbers):
+            return None
+        
+        # Check if seats are valid and not already booked or held for someone else
+        layout = _showing_layout(showing)
+        requested = layout.mask(seat_numbers)
+        taken = _booked_seat_map(showing, layout) | _held_seat_map(showing_id, layout, str(user_id))
+        if requested is None or taken & requested:
+            return None
+        
+        # Create booking
+        booking_id = _next_id('bookings')
+        total_price = len(seat_numbers) * showing.price_cents
+        
+        new_booking = {
+            'booking_id': booking_id,
+            'user_id': user_id,
+            'showing_id': showing_id,
+            'seats_booked': str(len(seat_numbers)),
+            'seat_numbers': ','.join(seat_numbers),
+            'total_price': format_cents(total_price),
+            'booking_date': datetime.datetime.now().isoformat()
+        }
+        
+        # Save changes; the showing's seats available follow from the bookings
+        _save_booking(new_booking)
+        
+        return booking_id
 
-def get_user_bookings(user_id: str) -> List[Dict]:
+def get_user_bookings(user_id: str) -> List[Record]:
     """Get all bookings for a user."""
-    bookings = _read_csv('bookings')
-    return [b for b in bookings if b['user_id'] == user_id]
+    return _find_rows('bookings', 'user_id', user_id)
 
+@_retry_stale
 def cancel_booking(booking_id: str, user_id: str) -> bool:
     """Cancel a booking and return seats to availability."""
-    bookings = _read_csv('bookings')
-    movies = _read_csv('movies_showings')
-    
     # Convert inputs to strings to ensure consistency
     booking_id = str(booking_id)
     user_id = str(user_id)
     
-    # Find the booking
-    booking = None
-    for b in bookings:
-        # Convert booking data to strings for comparison
-        b_booking_id = str(b['booking_id'])
-        b_user_id = str(b['user_id'])
-        
-        if b_booking_id == booking_id and b_user_id == user_id:
-            booking = b
-            break
+    # Find the booking, again once its showing is locked
+    booking = _get_row('bookings', booking_id)
+    if booking:
+        with _lock_showings(booking['showing_id']):
+            return _cancel_booking(booking_id, user_id)
+    return _cancel_booking(booking_id, user_id)
+
+def _cancel_booking(booking_id: str, user_id: str) -> bool:
+    booking = _get_row('bookings', booking_id)
+    if booking and booking['user_id'] != user_id:
+        booking = None
     
     if not booking:
         # Debug: Print all bookings for troubleshooting
         print(f"DEBUG: Could not find booking {booking_id} for user {user_id}")
         print("Available bookings:")
-        for b in bookings:
+        for b in _table_rows('bookings'):
             print(f"  Booking {b['booking_id']} for user {b['user_id']}")
         return False
     
-    # Update movie seats
-    for movie in movies:
-        if movie['id'] == booking['showing_id']:
-            current_available = int(movie['available_seats'])
-            seats_to_restore = int(booking['seats_booked'])
-            movie['available_seats'] = str(current_available + seats_to_restore)
-            print(f"DEBUG: Restored {seats_to_restore} seats to movie {movie['id']}")
-            break
-    
-    # Remove booking - filter out the specific booking
-    original_count = len(bookings)
-    bookings = [b for b in bookings if str(b['booking_id']) != booking_id]
-    removed_count = original_count - len(bookings)
+    # Save changes; the seats return to the showing with the booking gone
+    _submit({'bookings': ([], [], [booking_id])}).result()
+    print(f"DEBUG: Restored {booking.seats_booked} seats to movie {booking['showing_id']}")
     
-    print(f"DEBUG: Removed {removed_count} booking(s) with ID {booking_id}")
-    print(f"DEBUG: Bookings remaining: {len(bookings)}")
+    print(f"DEBUG: Removed booking with ID {booking_id}")
     
-    # Save changes
-    _write_csv('bookings', bookings)
-    _write_csv('movies_showings', movies)
-    
-    # Verify the file was updated
-    updated_bookings = _read_csv('bookings')
-    print(f"DEBUG: After save, CSV contains {len(updated_bookings)} bookings")
+    # Verify the table was updated
+    print(f"DEBUG: After save, table contains {len(_table_rows('bookings'))} bookings")
     
     return True
 
-def get_theatre_bookings(theatre_id: str) -> List[Dict]:
+def get_theatre_revenue(theatre_id: str) -> str:
+    """Get the total price of all bookings for a theatre, e.g. '1250.00'."""
+    showing_ids = [movie['id'] for movie in _indexed_rows('movies_showings', 'theatre_id', theatre_id)]
+    bookings = _snapshot('bookings')
+    with _cache_lock.read():
+        return format_cents(sum(bookings.sales.get(showing_id, (0, 0))[1] for showing_id in showing_ids))
+
+def get_theatre_bookings(theatre_id: str) -> List[Record]:
     """Get all bookings for a specific theatre."""
-    bookings = _read_csv('bookings')
-    movies = _read_csv('movies_showings')
-    
-    theatre_movies = {m['id']: m for m in movies if m['theatre_id'] == theatre_id}
-    return [b for b in bookings if b['showing_id'] in theatre_movies]
+    bookings = []
+    for movie in _indexed_rows('movies_showings', 'theatre_id', theatre_id):
+        # Until bookings are cached this only reads the theatre's partition
+        bookings.extend(_find_rows('bookings', 'showing_id', movie['id']))
+    # Keep the order bookings were made in
+    bookings.sort(key=lambda b: b.booking_id)
+    return bookings
 
 # Seat Layout and Visual Selection Functions
-def get_seat_layout(showing_id: str) -> Dict:
-    """Get seat layout information for a showing."""
-    movies = _read_csv('movies_showings')
-    bookings = _read_csv('bookings')
-    
+def get_seat_layout(showing_id: str, user_id: Optional[str] = None) -> Dict:
+    """Get seat layout information for a showing.
+    
+    grid has a row of seat labels per row label, '' marking aisle gaps, and
+    positions maps each label to its bit in booked_mask, held_mask (seats
+    held for users other than user_id), blocked_mask and accessible_mask.
+    sections lists (name, first row, last row) by row index.
+    """
     # Find the showing
-    showing = None
-    for m in movies:
-        if m['id'] == showing_id:
-            showing = m
-            break
-    
+    showing = _get_showing(showing_id)
     if not showing:
         return {}
     
-    # Calculate seat layout (assuming 10 seats per row)
-    total_seats = int(showing['available_seats']) + sum(
-        int(b['seats_booked']) for b in bookings 
-        if b['showing_id'] == showing_id
-    )
-    
-    rows = (total_seats + 9) // 10  # Round up to get number of rows
-    seats_per_row = min(10, total_seats)
-    
-    # Get booked seats
-    booked_seats = []
-    for booking in bookings:
-        if booking['showing_id'] == showing_id:
-            booked_seats.extend(booking['seat_numbers'].split(','))
+    layout = _showing_layout(showing)
+    booked_mask = _booked_seat_map(showing, layout)
+    held_mask = _held_seat_map(showing_id, layout, None if user_id is None else str(user_id))
     
     # Generate seat layout
     seat_layout = {
-        'rows': rows,
-        'seats_per_row': seats_per_row,
-        'total_seats': total_seats,
-        'booked_seats': booked_seats,
-        'available_count': int(showing['available_seats'])
+        'rows': len(layout.grid),
+        'seats_per_row': layout.width,
+        'total_seats': layout.capacity,
+        'grid': layout.grid,
+        'row_labels': layout.row_labels,
+        'sections': layout.sections,
+        'positions': layout.positions,
+        'booked_seats': layout.seats_in(booked_mask),
+        'booked_mask': booked_mask,
+        'held_mask': held_mask,
+        'blocked_mask': layout.blocked_mask,
+        'accessible_mask': layout.accessible_mask,
+        'available_count': showing.available_seats
     }
     
     return seat_layout
 
-def generate_seat_grid(total_seats: int, seats_per_row: int = 10) -> List[List[str]]:
-    """Generate a grid of seat identifiers."""
-    rows = (total_seats + seats_per_row - 1) // seats_per_row
-    seat_grid = []
-    
-    seat_counter = 0
-    for row in range(rows):
-        row_letter = chr(65 + row)  # A, B, C, etc.
-        row_seats = []
-        for seat in range(seats_per_row):
-            if seat_counter < total_seats:
-                seat_id = f"{row_letter}{seat + 1}"
-                row_seats.append(seat_id)
-                seat_counter += 1
-            else:
-                # Add empty placeholder to maintain grid structure
-                row_seats.append("")
-        
-        # Only add the row if it has at least one real seat
-        if any(seat for seat in row_seats):
-            seat_grid.append(row_seats)
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def generate_seat_grid(total_seats: int, seats_per_row: int = SEATS_PER_ROW) -> Tuple[Tuple[str, ...], ...]:
+    """Generate a grid of seat identifiers, "" padding the last row.
+    
+    Grids are cached by size, so they come back as tuples that cannot be
+    changed by one caller under another.
+    """
+    layout = uniform_layout(total_seats, seats_per_row)
+    return tuple(row + ('',) * (seats_per_row - len(row)) for row in layout.grid)
+
+def find_best_seats(showing_id: str, count: int, preferences: Optional[Dict] = None,
+                    user_id: Optional[str] = None) -> List[str]:
+    """Find the best free block of count seats side by side for a showing.
+    
+    preferences may give 'ideal_row' (0.0 front to 1.0 back, default 0.6),
+    'section' (a section name of the theatre's layout) and 'accessible'
+    (True to include an accessible seat). Seats held for anyone but user_id
+    are not free. Returns the seat labels, or [] if no block fits.
+    """
+    showing = _get_showing(showing_id)
+    if not showing or count < 1 or count > showing.available_seats:
+        return []
+    preferences = preferences or {}
+    
+    layout = _showing_layout(showing)
+    rows = None
+    if preferences.get('section'):
+        matches = [(first, last) for name, first, last in layout.sections
+                   if name == preferences['section']]
+        if not matches:
+            return []
+        rows = matches[0]
+    
+    taken = (_booked_seat_map(showing, layout) | layout.blocked_mask
+             | _held_seat_map(showing_id, layout, None if user_id is None else str(user_id)))
+    free = ((1 << len(layout.labels)) - 1) & ~taken
+    return layout.best_block(free, count, preferences.get('ideal_row', 0.6), rows,
+                             bool(preferences.get('accessible')))
+
+def get_theatre_layout(theatre_id: str) -> Optional[Record]:
+    """Get the seat layout a theatre has defined, if any."""
+    return _get_row('layouts', theatre_id)
+
+@_retry_stale
+def set_theatre_layout(theatre_id: str, rows: str, sections: str = '') -> bool:
+    """Define a theatre's seat layout, see layouts.py for the format.
+    
+    The capacity of the theatre's showings follows the layout; fails if the
+    layout is malformed, has fewer seats than a showing has sold or no longer
+    has a seat that was booked.
+    """
+    try:
+        layout = parse_layout(rows, sections)
+    except ValueError:
+        return False
     
-    return seat_grid
+    with _lock_showings(*[s['id'] for s in _find_rows('movies_showings', 'theatre_id', theatre_id)]):
+        return _save_theatre_layout(theatre_id, rows, sections, layout)
 
+def _save_theatre_layout(theatre_id: str, rows: str, sections: str, layout: SeatLayout) -> bool:
+    showings = _with_sales(_find_rows('movies_showings', 'theatre_id', theatre_id))
+    if any(s.capacity is not None and s.seats_sold > layout.capacity for s in showings):
+        return False
+    # Every seat already sold must still be a seat of the new layout
+    for showing in showings:
+        for booking in _find_rows('bookings', 'showing_id', showing['id']):
+            if layout.mask(booking.seat_numbers.split(',')) is None:
+                return False
+    for showing in showings:
+        sold = showing.seats_sold if showing.capacity is not None else 0
+        showing.capacity = layout.capacity
+        showing.available_seats = layout.capacity - sold
+    
+    row = {'theatre_id': theatre_id, 'rows': rows, 'sections': sections}
+    with _transaction():
+        exists = _get_row('layouts', theatre_id) is not None
+        _save_tables({'layouts': ([], [row], []) if exists else ([row], [], []),
+                      'movies_showings': ([], showings, [])})
+    return True
+
+@_retry_stale
 def book_tickets_visual(user_id: str, showing_id: str, selected_seats: List[str]) -> Optional[str]:
     """Book tickets using visual seat selection."""
-    movies = _read_csv('movies_showings')
-    bookings = _read_csv('bookings')
-    
-    # Find the showing
-    showing = None
-    for m in movies:
-        if m['id'] == showing_id:
-            showing = m
-            break
-    
-    if not showing:
-        return None
-    
-    # Check if selected seats are available
-    existing_bookings = [b for b in bookings if b['showing_id'] == showing_id]
-    booked_seats = []
-    for booking in existing_bookings:
-        booked_seats.extend(booking['seat_numbers'].split(','))
-    
-    # Check if any selected seats are already booked
-    if any(seat in booked_seats for seat in selected_seats):
-        return None
-    
-    # Check if enough seats are available
-    available_seats = int(showing['available_seats'])
-    if available_seats < len(selected_seats):
-        return None
-    
-    # Create booking
-    booking_id = str(max([int(b['booking_id']) for b in bookings], default=0) + 1)
-    total_price = len(selected_seats) * float(showing['price'])
-    
-    new_booking = {
-        'booking_id': booking_id,
-        'user_id': user_id,
-        'showing_id': showing_id,
-        'seats_booked': str(len(selected_seats)),
-        'seat_numbers': ','.join(selected_seats),
-        'total_price': str(total_price),
-        'booking_date': datetime.datetime.now().isoformat()
-    }
-    
-    # Update available seats
-    showing['available_seats'] = str(available_seats - len(selected_seats))
-    
-    # Save changes
-    bookings.append(new_booking)
-    _write_csv('bookings', bookings)
-    _write_csv('movies_showings', movies)
-    
-    return booking_id
+    with _lock_showings(showing_id):
+        # Find the showing
+        showing = _get_showing(showing_id)
+        if not showing:
+            return None
+        
+        # Check if selected seats are valid and not already booked or held for someone else
+        layout = _showing_layout(showing)
+        requested = layout.mask(selected_seats)
+        taken = _booked_seat_map(showing, layout) | _held_seat_map(showing_id, layout, str(user_id))
+        if requested is None or taken & requested:
+            return None
+        
+        # Check if enough seats are available
+        available_seats = showing.available_seats
+        if available_seats < len(selected_seats):
+            return None
+        
+        # Create booking
+        booking_id = _next_id('bookings')
+        total_price = len(selected_seats) * showing.price_cents
+        
+        new_booking = {
+            'booking_id': booking_id,
+            'user_id': user_id,
+            'showing_id': showing_id,
+            'seats_booked': str(len(selected_seats)),
+            'seat_numbers': ','.join(selected_seats),
+            'total_price': format_cents(total_price),
+            'booking_date': datetime.datetime.now().isoformat()
+        }
+        
+        # Save changes; the showing's seats available follow from the bookings
+        _save_booking(new_booking)
+        
+        return booking_id
 
 # Theatre Admin Management Functions
+@_retry_stale
 def create_theatre_admin(username: str, password: str, theatre_id: str) -> bool:
     """Create a new theatre admin account."""
-    admins = _read_csv('admins')
-    
     # Check if username already exists
-    if any(a['username'] == username for a in admins):
+    if _find_rows('admins', 'username', username):
         return False
     
     # Hash password
     hashed_pass, salt = hash_password(password)
     
     # Generate new admin ID
-    admin_id = str(max([int(a['admin_id']) for a in admins if a['admin_id']], default=0) + 1)
+    admin_id = _next_id('admins')
     
     new_admin = {
         'admin_id': admin_id,
@@ -429,173 +1194,139 @@ def create_theatre_admin(username: str, password: str, theatre_id: str) -> bool:
         'theatre_id': theatre_id
     }
     
-    admins.append(new_admin)
-    _write_csv('admins', admins)
+    _save_rows('admins', inserted=[new_admin])
     return True
 
-def get_all_theatre_admins() -> List[Dict]:
+def get_all_theatre_admins() -> List[Record]:
     """Get all theatre admin accounts."""
-    admins = _read_csv('admins')
+    admins = _read_table('admins')
     return [a for a in admins if a['type'] == 'theatre']
 
+@_retry_stale
 def modify_theatre_admin(admin_id: str, username: str = None, 
                         password: str = None, theatre_id: str = None) -> bool:
     """Modify a theatre admin account."""
-    admins = _read_csv('admins')
-    
     # Find the admin
-    admin_found = False
-    for admin in admins:
-        if admin['admin_id'] == admin_id and admin['type'] == 'theatre':
-            admin_found = True
-            if username:
-                # Check if new username already exists
-                if any(a['username'] == username and a['admin_id'] != admin_id for a in admins):
-                    return False
-                admin['username'] = username
-            if password:
-                hashed_pass, salt = hash_password(password)
-                admin['password'] = hashed_pass
-                admin['salt'] = salt
-            if theatre_id:
-                admin['theatre_id'] = theatre_id
-            break
-    
-    if not admin_found:
+    admin = _get_row('admins', admin_id)
+    if not admin or admin['type'] != 'theatre':
         return False
     
-    _write_csv('admins', admins)
+    if username:
+        # Check if new username already exists
+        if any(a['admin_id'] != admin_id for a in _find_rows('admins', 'username', username)):
+            return False
+        admin['username'] = username
+    if password:
+        hashed_pass, salt = hash_password(password)
+        admin['password'] = hashed_pass
+        admin['salt'] = salt
+    if theatre_id:
+        admin['theatre_id'] = theatre_id
+    
+    _save_rows('admins', updated=[admin])
     return True
 
+@_retry_stale
 def delete_theatre_admin(admin_id: str) -> bool:
     """Delete a theatre admin account."""
-    admins = _read_csv('admins')
-    original_count = len(admins)
-    
     # Remove the admin
-    admins = [a for a in admins if not (a['admin_id'] == admin_id and a['type'] == 'theatre')]
-    
-    if len(admins) == original_count:
+    admin = _get_row('admins', admin_id)
+    if not admin or admin['type'] != 'theatre':
         return False
     
-    _write_csv('admins', admins)
+    _save_rows('admins', deleted=[admin_id])
     return True
 
 # User Account Management Functions
-def get_all_users() -> List[Dict]:
+def get_all_users() -> List[Record]:
     """Get all user accounts."""
-    return _read_csv('users')
+    return _read_table('users')
 
+@_retry_stale
 def modify_user(user_id: str, username: str = None, 
                password: str = None, email: str = None) -> bool:
     """Modify a user account."""
-    users = _read_csv('users')
-    
     # Find the user
-    user_found = False
-    for user in users:
-        if user['user_id'] == user_id:
-            user_found = True
-            if username:
-                # Check if new username already exists
-                if any(u['username'] == username and u['user_id'] != user_id for u in users):
-                    return False
-                user['username'] = username
-            if password:
-                hashed_pass, salt = hash_password(password)
-                user['password'] = hashed_pass
-                user['salt'] = salt
-            if email:
-                # Check if new email already exists
-                if any(u['email'] == email and u['user_id'] != user_id for u in users):
-                    return False
-                user['email'] = email
-            break
-    
-    if not user_found:
+    user = _get_row('users', user_id)
+    if not user:
         return False
     
-    _write_csv('users', users)
+    if username:
+        # Check if new username already exists
+        if any(u['user_id'] != user_id for u in _find_rows('users', 'username', username)):
+            return False
+        user['username'] = username
+    if password:
+        hashed_pass, salt = hash_password(password)
+        user['password'] = hashed_pass
+        user['salt'] = salt
+    if email:
+        # Check if new email already exists
+        if any(u['user_id'] != user_id for u in _find_rows('users', 'email', email)):
+            return False
+        user['email'] = email
+    
+    _save_rows('users', updated=[user])
     return True
 
+@_retry_stale
 def delete_user(user_id: str) -> bool:
     """Delete a user account and their bookings."""
-    users = _read_csv('users')
-    bookings = _read_csv('bookings')
-    movies = _read_csv('movies_showings')
-    
     # Check if user exists
-    user_exists = any(u['user_id'] == user_id for u in users)
-    if not user_exists:
+    if not _get_row('users', user_id):
         return False
     
     # Cancel all user's bookings and restore seats
-    user_bookings = [b for b in bookings if b['user_id'] == user_id]
-    for booking in user_bookings:
-        # Restore seats to movie
-        for movie in movies:
-            if movie['id'] == booking['showing_id']:
-                movie['available_seats'] = str(int(movie['available_seats']) + 
-                                             int(booking['seats_booked']))
-                break
-    
-    # Remove user and their bookings
-    users = [u for u in users if u['user_id'] != user_id]
-    bookings = [b for b in bookings if b['user_id'] != user_id]
+    showing_ids = [b['showing_id'] for b in _find_rows('bookings', 'user_id', user_id)]
+    with _lock_showings(*showing_ids):
+        return _delete_user(user_id)
+
+def _delete_user(user_id: str) -> bool:
+    user_bookings = _find_rows('bookings', 'user_id', user_id)
     
-    # Save changes
-    _write_csv('users', users)
-    _write_csv('bookings', bookings)
-    _write_csv('movies_showings', movies)
+    # Remove user and their bookings, which returns their seats
+    _submit({'users': ([], [], [user_id]),
+             'bookings': ([], [], [b['booking_id'] for b in user_bookings])}).result()
     return True
 
 # User Ban Management Functions
+@_retry_stale
 def ban_user_by_email(email: str) -> bool:
     """Ban a user by their email address."""
-    users = _read_csv('users')
-    
-    user_found = False
-    for user in users:
-        if user['email'] == email:
-            user_found = True
-            user['status'] = 'banned'
-            break
-    
-    if not user_found:
+    users = _find_rows('users', 'email', email)
+    if not users:
         return False
     
-    _write_csv('users', users)
+    user = users[0]
+    user['status'] = 'banned'
+    
+    _save_rows('users', updated=[user])
     return True
 
+@_retry_stale
 def unban_user_by_email(email: str) -> bool:
     """Unban a user by their email address."""
-    users = _read_csv('users')
-    
-    user_found = False
-    for user in users:
-        if user['email'] == email:
-            user_found = True
-            user['status'] = 'active'
-            break
-    
-    if not user_found:
+    users = _find_rows('users', 'email', email)
+    if not users:
         return False
     
-    _write_csv('users', users)
+    user = users[0]
+    user['status'] = 'active'
+    
+    _save_rows('users', updated=[user])
     return True
 
-def get_banned_users() -> List[Dict]:
+def get_banned_users() -> List[Record]:
     """Get all banned users."""
-    users = _read_csv('users')
+    users = _read_table('users')
     return [u for u in users if u.get('status', 'active') == 'banned']
 
-def find_user_by_email(email: str) -> Optional[Dict]:
+def find_user_by_email(email: str) -> Optional[Record]:
     """Find a user by their email address."""
-    users = _read_csv('users')
-    for user in users:
-        if user['email'] == email:
-            return user
-    return None
+    users = _find_rows('users', 'email', email)
+    return users[0] if users else None
 
-# Initialize system when module is imported
-ensure_csv_files_exist()
\ No newline at end of file
+if __name__ == '__main__':
+    # python handler.py: create missing tables, filled with the example data
+    ensure_csv_files_exist()
+    print("Tables are ready.")
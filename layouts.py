@@ -0,0 +1,204 @@
+"""Auditorium seat layouts.
+
+A theatre's layout is stored as compact text, rows separated by '/':
+
+    10*4,1a,12,1a,4/2w,1a,12,1a,2w
+
+Each row is a comma-separated run of cells, a count followed by the kind of
+cell: s (seat, the default), a (aisle gap), x (blocked seat) or w
+(wheelchair accessible seat). 'N*' in front of a row repeats it N times.
+Sections name ranges of rows counted from 1, e.g. 'Stalls:1-10,Circle:11-11'.
+
+Rows are labelled A to Z, then AA, AB and so on, and seats are numbered
+from 1 within their row, skipping aisle gaps. Seat positions count the seats
+row by row; booked seats are kept as int bitsets over these positions.
+"""
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from types import MappingProxyType
+from typing import List, Mapping, Optional, Tuple
+
+# Rows of theatres without a layout of their own
+SEATS_PER_ROW = 10
+
+# Layouts kept expanded, by spec (or by size for the default layout)
+LAYOUT_CACHE_SIZE = 64
+
+SEAT, AISLE, BLOCKED, ACCESSIBLE = 's', 'a', 'x', 'w'
+
+def row_label(index: int) -> str:
+    """Return the label of the row at index: A..Z, then AA, AB, ..."""
+    label = ''
+    index += 1
+    while index:
+        index, letter = divmod(index - 1, 26)
+        label = chr(65 + letter) + label
+    return label
+
+class SeatLayout:
+    """An expanded layout. Built once per spec, then shared and never modified."""
+    __slots__ = ('rows', 'sections_spec', 'grid', 'row_labels', 'row_starts', 'columns',
+                 'labels', 'positions', 'blocked_mask', 'accessible_mask', 'adjacent_mask',
+                 'sections', 'width', 'capacity')
+
+    def __init__(self, rows: str, cells: List[List[str]], sections: str = ''):
+        self.rows = rows
+        self.sections_spec = sections
+        self.row_labels = tuple(row_label(index) for index in range(len(cells)))
+        # Position of the first seat in each row, plus the total at the end
+        self.row_starts = array('I')
+        # Grid column of each seat, aisle gaps included
+        self.columns = array('H')
+        labels = []
+        grid = []
+        blocked = accessible = 0
+        for row_index, row in enumerate(cells):
+            self.row_starts.append(len(labels))
+            grid_row = []
+            number = 0
+            for column, kind in enumerate(row):
+                if kind == AISLE:
+                    grid_row.append('')
+                    continue
+                number += 1
+                label = f"{self.row_labels[row_index]}{number}"
+                if kind == BLOCKED:
+                    blocked |= 1 << len(labels)
+                elif kind == ACCESSIBLE:
+                    accessible |= 1 << len(labels)
+                self.columns.append(column)
+                labels.append(label)
+                grid_row.append(label)
+            grid.append(tuple(grid_row))
+        self.row_starts.append(len(labels))
+
+        self.grid = tuple(grid)
+        self.labels = tuple(labels)
+        self.positions: Mapping[str, int] = MappingProxyType(
+            {label: position for position, label in enumerate(labels)})
+        self.blocked_mask = blocked
+        self.accessible_mask = accessible
+        # Seats with the next seat right beside them, same row and no aisle between
+        row_starts = set(self.row_starts)
+        self.adjacent_mask = sum(1 << position for position in range(len(labels) - 1)
+                                 if self.columns[position + 1] == self.columns[position] + 1
+                                 and position + 1 not in row_starts)
+        self.width = max((len(row) for row in cells), default=0)
+        self.capacity = len(labels) - bin(blocked).count('1')
+        self.sections = _parse_sections(sections, len(cells))
+
+    def mask(self, seats: List[str]) -> Optional[int]:
+        """Return the bitset of the selected seats, or None if one is unknown,
+        blocked or repeated."""
+        positions = self.positions
+        mask = 0
+        for seat in seats:
+            position = positions.get(seat)
+            if position is None or (mask | self.blocked_mask) >> position & 1:
+                return None
+            mask |= 1 << position
+        return mask
+
+    def booked_bits(self, seat_numbers: str) -> int:
+        """Return the bitset of a booking's stored seat list, skipping unknown labels."""
+        positions = self.positions
+        bits = 0
+        for seat in seat_numbers.split(','):
+            position = positions.get(seat)
+            if position is not None:
+                bits |= 1 << position
+        return bits
+
+    def best_block(self, free: int, count: int, ideal_row: float = 0.6,
+                   rows: Optional[Tuple[int, int]] = None, accessible: bool = False) -> List[str]:
+        """Return the labels of the best block of count free seats side by side.
+        
+        Blocks are scored by distance from ideal_row (0.0 the front row, 1.0
+        the back, of the rows searched) plus distance from the middle of their
+        row. rows limits the search to (first, last) row indexes, accessible
+        to blocks with an accessible seat. Returns [] if no block fits.
+        """
+        if count < 1:
+            return []
+        first_row, last_row = rows if rows is not None else (0, len(self.grid) - 1)
+        if rows is not None:
+            first, last = self.row_starts[first_row], self.row_starts[last_row + 1]
+            free &= ((1 << last) - 1) ^ ((1 << first) - 1)
+        
+        # Bit p of starts is set when seats p .. p + count - 1 are all free and
+        # side by side, worked out for every row at once
+        starts = free
+        for offset in range(1, count):
+            starts &= (self.adjacent_mask >> (offset - 1)) & (free >> offset)
+        
+        best, best_score = None, None
+        depth = max(last_row - first_row, 1)
+        block = (1 << count) - 1
+        while starts:
+            low = starts & -starts
+            starts ^= low
+            position = low.bit_length() - 1
+            if accessible and not (self.accessible_mask >> position) & block:
+                continue
+            row = bisect_right(self.row_starts, position) - 1
+            middle = (self.columns[position] + self.columns[position + count - 1]) / 2
+            row_middle = (len(self.grid[row]) - 1) / 2
+            score = (abs((row - first_row) / depth - ideal_row)
+                     + abs(middle - row_middle) / max(self.width, 1))
+            if best_score is None or score < best_score:
+                best, best_score = position, score
+        
+        if best is None:
+            return []
+        return list(self.labels[best:best + count])
+
+    def seats_in(self, bits: int) -> List[str]:
+        """Return the labels of the seats in a bitset, in position order."""
+        return [self.labels[position] for position in range(bits.bit_length()) if bits >> position & 1]
+
+def _parse_row(text: str) -> List[str]:
+    cells = []
+    for token in text.split(','):
+        token = token.strip()
+        count, kind = (token[:-1], token[-1]) if token[-1:].isalpha() else (token, SEAT)
+        if kind not in (SEAT, AISLE, BLOCKED, ACCESSIBLE) or not count.isdigit():
+            raise ValueError(f"Bad layout cell: {token!r}")
+        cells.extend(kind * int(count))
+    return cells
+
+def _parse_sections(text: str, row_count: int) -> Tuple[Tuple[str, int, int], ...]:
+    """Parse 'Name:first-last,...' into (name, first row index, last row index)."""
+    sections = []
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        name, _, rows = part.rpartition(':')
+        first, _, last = rows.partition('-')
+        if not (name and first.isdigit() and (last or first).isdigit()):
+            raise ValueError(f"Bad layout section: {part!r}")
+        first, last = int(first), int(last or first)
+        if not 1 <= first <= last <= row_count:
+            raise ValueError(f"Layout section out of range: {part!r}")
+        sections.append((name, first - 1, last - 1))
+    return tuple(sections)
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def parse_layout(rows: str, sections: str = '') -> SeatLayout:
+    """Expand a layout spec, raising ValueError if it is malformed."""
+    cells = []
+    for part in filter(None, (part.strip() for part in rows.split('/'))):
+        repeat, _, row = part.rpartition('*')
+        if repeat and not repeat.strip().isdigit():
+            raise ValueError(f"Bad layout row: {part!r}")
+        cells.extend([_parse_row(row)] * int(repeat or 1))
+    if not cells:
+        raise ValueError("Layout has no rows")
+    return SeatLayout(rows, cells, sections)
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def uniform_layout(total_seats: int, seats_per_row: int = SEATS_PER_ROW) -> SeatLayout:
+    """Layout of total_seats in full rows of seats_per_row, the last one shorter."""
+    full_rows, rest = divmod(total_seats, seats_per_row)
+    cells = [[SEAT] * seats_per_row] * full_rows + ([[SEAT] * rest] if rest else [])
+    spec = '/'.join(filter(None, (f"{full_rows}*{seats_per_row}" if full_rows else '',
+                                  str(rest) if rest else '')))
+    return SeatLayout(spec, cells)
@@ -0,0 +1,315 @@
+"""Typed rows for the PVC tables.
+
+Each stored row is parsed once into a record with __slots__ that keeps
+native values: ids and counts as ints, prices as whole cents. Records still
+answer row['column'] with the text stored in the table (and accept text on
+assignment), so they can stand in for the dict rows handler used to pass
+around.
+"""
+import gc
+from decimal import Decimal, ROUND_HALF_UP
+from operator import attrgetter
+from typing import Dict, Iterable, List, Optional
+
+def parse_int(text: str) -> Optional[int]:
+    """Parse a stored integer, '' meaning no value."""
+    return int(text) if text else None
+
+def format_int(value: Optional[int]) -> str:
+    return '' if value is None else str(value)
+
+def parse_cents(text: str) -> Optional[int]:
+    """Parse a stored price such as '12.5' into whole cents (1250)."""
+    if not text:
+        return None
+    whole, _, fraction = text.partition('.')
+    if whole.isdigit() and len(fraction) <= 2 and (fraction.isdigit() or not fraction):
+        return int(whole) * 100 + int(fraction.ljust(2, '0'))
+    # Anything unusual, e.g. '36.000000000000004' from float arithmetic
+    return int((Decimal(text) * 100).to_integral_value(ROUND_HALF_UP))
+
+def format_cents(value: Optional[int]) -> str:
+    """Format whole cents as a price such as '12.50'."""
+    if value is None:
+        return ''
+    return f"{value // 100}.{value % 100:02d}"
+
+def _text(value: str) -> str:
+    return value
+
+class _Memo(dict):
+    """Parsed values by stored text, parsing each text on first lookup."""
+    __slots__ = ('parse',)
+
+    def __init__(self, parse):
+        super().__init__()
+        self.parse = parse
+
+    def __missing__(self, text):
+        value = self[text] = self.parse(text)
+        return value
+
+class Record:
+    """Base class for typed table rows.
+
+    Subclasses list their COLUMNS in table order as
+    (column name, attribute, parse text, format value).
+    """
+    __slots__ = ()
+    TABLE = ''
+    COLUMNS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.FIELDS = tuple(column for column, _, _, _ in cls.COLUMNS)
+        cls.ATTRIBUTES = tuple(attribute for _, attribute, _, _ in cls.COLUMNS)
+        cls.PARSERS = tuple(parse for _, _, parse, _ in cls.COLUMNS)
+        cls._BY_COLUMN = {column: (attribute, parse, fmt) for column, attribute, parse, fmt in cls.COLUMNS}
+
+    @classmethod
+    def from_values(cls, values: List[str]) -> 'Record':
+        """Build a record from the stored text of each column, in table order."""
+        return cls(*[parse(text) for parse, text in zip(cls.PARSERS, values)])
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[List[str]]) -> List['Record']:
+        """Build records in bulk from lists of stored text, e.g. from csv.reader.
+        
+        The lists are converted in place and only columns that are not plain
+        text get parsed. Apart from the leading id, column values repeat a lot
+        (user ids, prices) so each distinct text is parsed once and the value
+        shared. The cyclic collector is paused meanwhile since the burst of new
+        objects would trigger collections that can find no garbage.
+        """
+        converters = [(index, parse if index == 0 else _Memo(parse).__getitem__)
+                      for index, parse in enumerate(cls.PARSERS) if parse is not _text]
+        records = []
+        append = records.append
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            for row in rows:
+                for index, convert in converters:
+                    row[index] = convert(row[index])
+                append(cls(*row))
+        finally:
+            if collecting:
+                gc.enable()
+        return records
+
+    @classmethod
+    def from_columns(cls, columns: List[list]) -> List['Record']:
+        """Build records in bulk from one list of values per attribute, as
+        returned by to_columns. Nothing needs parsing."""
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            return list(map(cls, *columns))
+        finally:
+            if collecting:
+                gc.enable()
+
+    @classmethod
+    def to_columns(cls, records: Iterable['Record']) -> List[list]:
+        """Return the values of records, one list per attribute in table order."""
+        records = list(records)
+        return [list(map(attrgetter(attribute), records)) for attribute in cls.ATTRIBUTES]
+
+    @classmethod
+    def from_dict(cls, row: Dict) -> 'Record':
+        """Build a record from a dict of column values; missing columns are empty."""
+        return cls.from_values(['' if row.get(column) is None else str(row[column])
+                                for column in cls.FIELDS])
+
+    def values(self) -> List[str]:
+        """Return the stored text of each column, in table order."""
+        return [fmt(getattr(self, attribute)) for _, attribute, _, fmt in self.COLUMNS]
+
+    def to_dict(self) -> Dict[str, str]:
+        return dict(zip(self.FIELDS, self.values()))
+
+    def copy(self) -> 'Record':
+        return type(self)(*[getattr(self, attribute) for attribute in self.ATTRIBUTES])
+
+    # Read and write access by column name, in stored text form
+    def __getitem__(self, column: str) -> str:
+        attribute, _, fmt = self._BY_COLUMN[column]
+        return fmt(getattr(self, attribute))
+
+    def __setitem__(self, column: str, value):
+        attribute, parse, _ = self._BY_COLUMN[column]
+        setattr(self, attribute, parse('' if value is None else str(value)))
+
+    def get(self, column: str, default=None):
+        return self[column] if column in self._BY_COLUMN else default
+
+    def keys(self):
+        return self.FIELDS
+
+    def items(self):
+        return list(zip(self.FIELDS, self.values()))
+
+    def __contains__(self, column) -> bool:
+        return column in self._BY_COLUMN
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self) -> int:
+        return len(self.FIELDS)
+
+    def __eq__(self, other) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, attribute) == getattr(other, attribute) for attribute in self.ATTRIBUTES)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+class Showing(Record):
+    """A movie showing, price in cents.
+
+    The available_seats stored with a showing is only refreshed when the
+    showing is saved. The handler works it out from the bookings, as
+    capacity minus the seats sold, on the copies it hands out, so
+    seats_sold and sold_out only hold on those.
+    """
+    __slots__ = ('id', 'title', 'genre', 'duration', 'theatre_id', 'showtime',
+                 'available_seats', 'price_cents', 'image_url', 'capacity')
+    TABLE = 'movies_showings'
+    COLUMNS = (
+        ('id', 'id', parse_int, format_int),
+        ('title', 'title', _text, _text),
+        ('genre', 'genre', _text, _text),
+        ('duration', 'duration', parse_int, format_int),
+        ('theatre_id', 'theatre_id', _text, _text),
+        ('showtime', 'showtime', _text, _text),
+        ('available_seats', 'available_seats', parse_int, format_int),
+        ('price', 'price_cents', parse_cents, format_cents),
+        ('image_url', 'image_url', _text, _text),
+        ('capacity', 'capacity', parse_int, format_int),
+    )
+
+    def __init__(self, id, title, genre, duration, theatre_id, showtime,
+                 available_seats, price_cents, image_url, capacity):
+        self.id = id
+        self.title = title
+        self.genre = genre
+        self.duration = duration
+        self.theatre_id = theatre_id
+        self.showtime = showtime
+        self.available_seats = available_seats
+        self.price_cents = price_cents
+        self.image_url = image_url
+        self.capacity = capacity
+
+    @property
+    def seats_sold(self) -> int:
+        return self.capacity - self.available_seats
+
+    @property
+    def sold_out(self) -> bool:
+        return self.available_seats <= 0
+
+class User(Record):
+    """A customer account."""
+    __slots__ = ('user_id', 'username', 'password', 'salt', 'email', 'status')
+    TABLE = 'users'
+    COLUMNS = (
+        ('user_id', 'user_id', parse_int, format_int),
+        ('username', 'username', _text, _text),
+        ('password', 'password', _text, _text),
+        ('salt', 'salt', _text, _text),
+        ('email', 'email', _text, _text),
+        ('status', 'status', _text, _text),
+    )
+
+    def __init__(self, user_id, username, password, salt, email, status):
+        self.user_id = user_id
+        self.username = username
+        self.password = password
+        self.salt = salt
+        self.email = email
+        self.status = status
+
+class Admin(Record):
+    """A system or theatre admin account."""
+    __slots__ = ('admin_id', 'username', 'password', 'salt', 'type', 'theatre_id')
+    TABLE = 'admins'
+    COLUMNS = (
+        ('admin_id', 'admin_id', parse_int, format_int),
+        ('username', 'username', _text, _text),
+        ('password', 'password', _text, _text),
+        ('salt', 'salt', _text, _text),
+        ('type', 'type', _text, _text),
+        ('theatre_id', 'theatre_id', _text, _text),
+    )
+
+    def __init__(self, admin_id, username, password, salt, type, theatre_id):
+        self.admin_id = admin_id
+        self.username = username
+        self.password = password
+        self.salt = salt
+        self.type = type
+        self.theatre_id = theatre_id
+
+class Booking(Record):
+    """A booking of one or more seats, total price in cents."""
+    __slots__ = ('booking_id', 'user_id', 'showing_id', 'seats_booked',
+                 'seat_numbers', 'total_price_cents', 'booking_date')
+    TABLE = 'bookings'
+    COLUMNS = (
+        ('booking_id', 'booking_id', parse_int, format_int),
+        ('user_id', 'user_id', parse_int, format_int),
+        ('showing_id', 'showing_id', parse_int, format_int),
+        ('seats_booked', 'seats_booked', parse_int, format_int),
+        ('seat_numbers', 'seat_numbers', _text, _text),
+        ('total_price', 'total_price_cents', parse_cents, format_cents),
+        ('booking_date', 'booking_date', _text, _text),
+    )
+
+    def __init__(self, booking_id, user_id, showing_id, seats_booked,
+                 seat_numbers, total_price_cents, booking_date):
+        self.booking_id = booking_id
+        self.user_id = user_id
+        self.showing_id = showing_id
+        self.seats_booked = seats_booked
+        self.seat_numbers = seat_numbers
+        self.total_price_cents = total_price_cents
+        self.booking_date = booking_date
+
+class Layout(Record):
+    """A theatre's seat layout, in the compact text form read by layouts.parse_layout."""
+    __slots__ = ('theatre_id', 'rows', 'sections')
+    TABLE = 'layouts'
+    COLUMNS = (
+        ('theatre_id', 'theatre_id', _text, _text),
+        ('rows', 'rows', _text, _text),
+        ('sections', 'sections', _text, _text),
+    )
+
+    def __init__(self, theatre_id, rows, sections):
+        self.theatre_id = theatre_id
+        self.rows = rows
+        self.sections = sections
+
+class Hold(Record):
+    """Seats held for a user until expires_at, in Unix time."""
+    __slots__ = ('hold_id', 'user_id', 'showing_id', 'seat_numbers', 'expires_at')
+    TABLE = 'holds'
+    COLUMNS = (
+        ('hold_id', 'hold_id', _text, _text),
+        ('user_id', 'user_id', _text, _text),
+        ('showing_id', 'showing_id', _text, _text),
+        ('seat_numbers', 'seat_numbers', _text, _text),
+        ('expires_at', 'expires_at', parse_int, format_int),
+    )
+
+    def __init__(self, hold_id, user_id, showing_id, seat_numbers, expires_at):
+        self.hold_id = hold_id
+        self.user_id = user_id
+        self.showing_id = showing_id
+        self.seat_numbers = seat_numbers
+        self.expires_at = expires_at
+
+RECORD_TYPES = {record.TABLE: record for record in (Showing, User, Admin, Booking, Layout, Hold)}
@@ -0,0 +1,1576 @@
+"""Storage backends for the PVC tables.
+
+handler.py holds the business logic and an in-memory copy of every table.
+The backends here only know how to load a table and persist row changes:
+CSVBackend keeps one CSV file per table (the default), SQLiteBackend keeps
+the same tables in a single SQLite database.
+"""
+import atexit
+import csv
+import io
+import json
+import marshal
+import mmap
+import os
+import re
+import sqlite3
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from operator import attrgetter
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+from records import RECORD_TYPES, Record
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: tables are only locked between threads of one process, so
+    # only one process may use the files at a time
+    fcntl = None
+
+# Lock files and the write-ahead log are read and written as raw bytes
+_O_BINARY = getattr(os, 'O_BINARY', 0)
+
+# Global configuration
+STORAGE_BACKEND = os.environ.get('PVC_STORAGE', 'csv')  # 'csv' or 'sqlite'
+SQLITE_PATH = os.environ.get('PVC_SQLITE_PATH', 'pvc.db')
+
+CSV_FILES = {
+    'movies_showings': 'movies_showings.csv',
+    'users': 'users.csv',
+    'admins': 'admins.csv',
+    'bookings': 'bookings.csv',
+    'layouts': 'layouts.csv',
+    'holds': 'holds.csv'
+}
+
+CSV_HEADERS = {table: list(record.FIELDS) for table, record in RECORD_TYPES.items()}
+
+PRIMARY_KEYS = {
+    'movies_showings': 'id',
+    'users': 'user_id',
+    'admins': 'admin_id',
+    'bookings': 'booking_id',
+    'layouts': 'theatre_id',
+    'holds': 'hold_id'
+}
+
+# Columns that get an index besides the primary key
+INDEXED_FIELDS = {
+    'movies_showings': ('theatre_id',),
+    'users': ('username', 'email'),
+    'bookings': ('showing_id', 'user_id')
+}
+
+# Integer columns summed over live rows, by the value of another column, that
+# backends can tell without loading the table: table -> (grouped by, summed).
+# For bookings, the seats sold per showing.
+TOTALED_FIELDS = {
+    'bookings': ('showing_id', 'seats_booked')
+}
+
+# Bookings are split into one file per partition, kept in a directory named
+# after the table file (bookings.csv -> bookings/) along with a manifest of
+# the partition each showing's bookings go to:
+#   'theatre' - one file per theatre, found through the showing's theatre_id
+#   'showing' - one file per showing
+#   'none'    - everything in bookings.csv
+BOOKING_PARTITIONS = os.environ.get('PVC_BOOKING_PARTITIONS', 'theatre')
+
+# Partition files of a table written at the same time
+PARTITION_WRITERS = 8
+
+# Tables written by appending rows. A row whose fields are all empty apart
+# from the primary key is a tombstone that deletes the earlier row.
+APPEND_ONLY_TABLES = ('bookings', 'holds')
+
+# When to fsync written files:
+#   'always' - before every write returns (survives power loss, slowest)
+#   'batch'  - group commit, at most FSYNC_BATCH_MS after the write
+#   'never'  - leave it to the operating system
+FSYNC_POLICY = 'always'
+FSYNC_BATCH_MS = 50
+
+# Write-ahead log of the CSV tables: every change is logged here before the
+# tables are touched, and replayed onto them on startup after a crash. It is
+# checkpointed (tables synced, log emptied) once it grows past this size.
+# FSYNC_POLICY then applies to the log; rows appended to a table are only
+# synced at the checkpoint, whole files written still are right away.
+WAL_PATH = 'pvc.wal'
+WAL_CHECKPOINT_BYTES = 1 << 20
+
+# Binary snapshots of the CSV tables (e.g. users.snap, bookings.snap), written
+# at each checkpoint and loaded instead of the CSV while they are current; an
+# append-only table is taken from its snapshot plus what was appended since.
+# Bump SNAPSHOT_FORMAT whenever records keep their values differently.
+SNAPSHOTS = True
+SNAPSHOT_FORMAT = 2
+
+# Compact an append-only file once dead rows exceed this share of live rows
+COMPACT_RATIO = 0.5
+COMPACT_MIN_DEAD_ROWS = 100
+
+class StaleWriteError(Exception):
+    """A write was refused because the stored table changed since it was read."""
+
+def to_records(table: str, rows: List[Dict]) -> List[Record]:
+    """Turn dict rows into the table's record type; records pass through."""
+    record_type = RECORD_TYPES[table]
+    return [row if isinstance(row, record_type) else record_type.from_dict(row) for row in rows]
+
+# Durable writes
+
+# Files waiting for the next group commit under the 'batch' fsync policy
+_pending_fsyncs = set()
+_fsync_timer = None
+_fsync_lock = threading.Lock()
+
+def _fsync_path(path: str):
+    """fsync a file or directory by name."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # Directories cannot be opened on Windows, nothing to sync there
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def flush_pending_fsyncs():
+    """fsync every file written since the last group commit."""
+    global _fsync_timer
+    with _fsync_lock:
+        paths = list(_pending_fsyncs)
+        _pending_fsyncs.clear()
+        _fsync_timer = None
+    for path in paths:
+        _fsync_path(path)
+
+def _sync_written(filename: str, fd: Optional[int] = None, renamed: bool = False):
+    """Make a finished write durable according to FSYNC_POLICY.
+
+    fd is the still open file, renamed tells whether the write replaced the
+    file, in which case its directory entry has to be synced as well.
+    """
+    global _fsync_timer
+    directory = os.path.dirname(os.path.abspath(filename))
+    if FSYNC_POLICY == 'always':
+        if fd is not None:
+            os.fsync(fd)
+        else:
+            _fsync_path(filename)
+        if renamed:
+            _fsync_path(directory)
+    elif FSYNC_POLICY == 'batch':
+        with _fsync_lock:
+            _pending_fsyncs.add(os.path.abspath(filename))
+            if renamed:
+                _pending_fsyncs.add(directory)
+            if _fsync_timer is None:
+                _fsync_timer = threading.Timer(FSYNC_BATCH_MS / 1000, flush_pending_fsyncs)
+                _fsync_timer.daemon = True
+                _fsync_timer.start()
+
+atexit.register(flush_pending_fsyncs)
+
+@contextmanager
+def atomic_open(filename: str, mode: str = 'w'):
+    """Open a temporary file that replaces filename once the block succeeds.
+
+    Readers see either the old or the new contents, never a partial file.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_name = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(filename)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode, newline=None if 'b' in mode else '') as f:
+            yield f
+            f.flush()
+            if FSYNC_POLICY == 'always':
+                os.fsync(f.fileno())
+        try:
+            # mkstemp creates the file private, keep the original permissions
+            os.chmod(temp_name, stat.S_IMODE(os.stat(filename).st_mode))
+        except FileNotFoundError:
+            pass
+        os.replace(temp_name, filename)
+    except BaseException:
+        try:
+            os.unlink(temp_name)
+        except OSError:
+            pass
+        raise
+
+    if FSYNC_POLICY == 'always':
+        _fsync_path(directory)
+    else:
+        _sync_written(filename, renamed=True)
+
+# Backends
+
+class StorageBackend:
+    """Interface between the handler and the place its tables are kept."""
+
+    def signature(self, table: str) -> Hashable:
+        """Return a value that changes whenever the stored table changes."""
+        raise NotImplementedError
+
+    def load(self, table: str) -> Tuple[Hashable, List[Record]]:
+        """Read every live row of a table as records, together with its signature."""
+        raise NotImplementedError
+
+    def find(self, table: str, field: str, value: str) -> Optional[List[Record]]:
+        """Look rows up through an index, or return None if only a full load can."""
+        return None
+
+    def totals(self, table: str) -> Optional[Dict[str, int]]:
+        """Return the TOTALED_FIELDS sums over a table's live rows by group,
+        e.g. the seats sold per showing, or None if only a full load can tell."""
+        return None
+
+    def load_since(self, table: str, signature: Hashable
+                   ) -> Optional[Tuple[Hashable, List[Record], List[str]]]:
+        """Read only what was written to a table after it had signature.
+
+        Returns the new signature, the rows added or replaced since and the
+        primary keys deleted since, or None if only a full load can tell.
+        """
+        return None
+
+    def write_changes(self, table: str, expected: Hashable, inserted: List[Record],
+                      updated: List[Record], deleted: List[str],
+                      all_rows: Callable[[], List[Record]]) -> Optional[Hashable]:
+        """Persist inserted and updated rows and the primary keys in deleted.
+
+        expected is the signature the caller's copy of the table was loaded at
+        and all_rows returns that copy with the changes applied, for backends
+        that rewrite whole tables. Returns the new signature. Raises
+        StaleWriteError, without writing anything, when the stored table was
+        changed by someone else since; the caller must reload and retry.
+        """
+        raise NotImplementedError
+
+    def write_batch(self, changes: Dict[str, Tuple[Hashable, List[Record], List[Record], List[str],
+                                                   Callable[[], List[Record]]]]) -> Dict[str, Hashable]:
+        """Persist changes to several tables, all of them or none.
+
+        changes maps each table to the arguments write_changes takes after
+        the table. Returns the new signature of each table. Raises
+        StaleWriteError, without writing anything, if any table is stale.
+        """
+        with self.transaction():
+            for table, (expected, *_) in changes.items():
+                if self.signature(table) != expected:
+                    raise StaleWriteError(table)
+            return {table: self.write_changes(table, *args) for table, args in changes.items()}
+
+    def reserve_ids(self, table: str, count: int) -> int:
+        """Reserve count new primary keys for table. Returns the first one.
+
+        Reserved keys are never handed out again, not even to other processes.
+        """
+        raise NotImplementedError
+
+    def transaction(self):
+        """Group writes to several tables so they commit together.
+
+        Other writers, including other processes, are kept out until it ends.
+        """
+        return nullcontext()
+
+    def create_missing(self, seed: Dict[str, List[Dict]]):
+        """Create missing tables, filling newly created ones with seed rows."""
+        raise NotImplementedError
+
+    def compact(self, table: str, all_rows: Callable[[], List[Record]]) -> int:
+        """Reclaim space held by deleted rows. Returns the rows dropped."""
+        return 0
+
+def _max_numeric_id(table: str, rows: List[Record]) -> int:
+    """Return the largest primary key among rows, 0 if there is none."""
+    key = PRIMARY_KEYS[table]
+    return max((int(row[key]) for row in rows if row[key]), default=0)
+
+def _file_signature(stat_result: os.stat_result) -> Tuple[int, int, int]:
+    """Identify a version of a file by its mtime, size and inode."""
+    return (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+
+def _tombstone(table: str, row_id: str) -> List[str]:
+    """Build the CSV row that deletes row_id from an append-only table."""
+    key = PRIMARY_KEYS[table]
+    return [row_id if field == key else '' for field in CSV_HEADERS[table]]
+
+def _positional_rows(table: str, header: List[str], reader: Iterable[List[str]]) -> Iterator[List[str]]:
+    """Yield the CSV rows after the header as value lists in CSV_HEADERS order.
+    
+    Files written by this module already match, so rows pass straight
+    through; other column orders go through a precomputed index map.
+    Blank lines are skipped and short rows padded, like csv.DictReader does.
+    """
+    columns = CSV_HEADERS[table]
+    width = len(columns)
+    if header == columns:
+        for row in reader:
+            if len(row) == width:
+                yield row
+            elif row:
+                yield (row + [''] * width)[:width]
+        return
+
+    positions = [header.index(column) if column in header else None for column in columns]
+    for row in reader:
+        if row:
+            yield [row[position] if position is not None and position < len(row) else ''
+                   for position in positions]
+
+def _read_rows(table: str, f, offset: int = 0) -> Iterator[List[str]]:
+    """Read the rows of a table file opened in binary mode, in CSV_HEADERS
+    order, starting at offset or else right after the header."""
+    header = next(csv.reader([f.readline().decode('utf-8')]), [])
+    if offset:
+        f.seek(offset)
+    return _positional_rows(table, header, csv.reader(io.StringIO(f.read().decode('utf-8'), newline='')))
+
+def _split_tail(table: str, rows: Iterable[List[str]]) -> Tuple[List[List[str]], List[str], int]:
+    """Like _fold_rows, for rows appended to a table already loaded.
+    
+    Returns the rows added or replaced, the primary keys deleted and roughly
+    how many rows, appended or earlier, the tail left dead.
+    """
+    key_index = CSV_HEADERS[table].index(PRIMARY_KEYS[table])
+    changed = {}
+    dead = 0
+    for row in rows:
+        if any(row[:key_index]) or any(row[key_index + 1:]):
+            changed[row[key_index]] = row
+            dead += 1
+        else:
+            changed[row[key_index]] = None
+            dead += 2
+    upserted = [row for row in changed.values() if row is not None]
+    # Brand new rows leave nothing dead behind
+    return upserted, [key for key, row in changed.items() if row is None], dead - len(upserted)
+
+def _fold_rows(table: str, rows: Iterable[List[str]]) -> Tuple[List[List[str]], int]:
+    """Apply appended rows and tombstones, in file order.
+    
+    A row whose fields are all empty apart from the primary key is a
+    tombstone. Returns the surviving rows and how many rows were dead.
+    """
+    key_index = CSV_HEADERS[table].index(PRIMARY_KEYS[table])
+    live = {}
+    total = 0
+    for row in rows:
+        total += 1
+        if any(row[:key_index]) or any(row[key_index + 1:]):
+            live[row[key_index]] = row
+        else:
+            live.pop(row[key_index], None)
+    return list(live.values()), total - len(live)
+
+# A snapshot file: magic, format and header length, then the marshalled
+# header (table, columns, signature) and body
+_SNAPSHOT_PREFIX = struct.Struct('<4sII')
+_SNAPSHOT_MAGIC = b'PVCS'
+
+def _read_snapshot_header(f) -> Optional[Tuple[str, list, Hashable]]:
+    """Read the header of a snapshot file, or return None if it is not a
+    snapshot of the current format."""
+    prefix = f.read(_SNAPSHOT_PREFIX.size)
+    if len(prefix) < _SNAPSHOT_PREFIX.size:
+        return None
+    magic, version, length = _SNAPSHOT_PREFIX.unpack(prefix)
+    if magic != _SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT:
+        return None
+    try:
+        return marshal.loads(f.read(length))
+    except (EOFError, ValueError, TypeError):
+        return None
+
+class _RowOffsets:
+    """Where the live rows of an append-only table file start, by primary key
+    and by the values of the table's INDEXED_FIELDS, found without decoding
+    the rows, along with the table's TOTALED_FIELDS sums over them. Rows
+    appended later are taken in by scanning on from size, as long as the
+    table's rewrite count and the file's inode stay the same."""
+    __slots__ = ('table', 'rewrites', 'inode', 'size', 'by_key', 'by_field', 'totals')
+
+    def __init__(self, table: str, rewrites: int, inode: int, size: int):
+        self.table = table
+        self.rewrites = rewrites
+        self.inode = inode
+        # Offset of the first row not scanned yet
+        self.size = size
+        # Primary key -> offset of its row, as bytes
+        self.by_key: Dict[bytes, int] = {}
+        # Field -> value -> primary keys that had it, including since replaced ones
+        self.by_field: Dict[str, Dict[bytes, List[bytes]]] = {
+            field: {} for field in INDEXED_FIELDS.get(table, ())}
+        # Grouped by value -> sum of the summed column, if the table has TOTALED_FIELDS
+        self.totals: Dict[bytes, int] = {}
+
+    def scan(self, mapped: mmap.mmap) -> bool:
+        """Index the complete rows of a mapped file from size on. Returns
+        False if a row needs the csv module to be told apart, e.g. a quoted
+        newline."""
+        columns = CSV_HEADERS[self.table]
+        width, key_index = len(columns), columns.index(PRIMARY_KEYS[self.table])
+        fields = [(columns.index(field), index) for field, index in self.by_field.items()]
+        totaled = [columns.index(field) for field in TOTALED_FIELDS.get(self.table, ())]
+        leading = max([key_index, *(position for position, _ in fields), *totaled]) + 1
+        by_key, totals = self.by_key, self.totals
+        position = self.size
+        mapped.seek(position)
+        for line in iter(mapped.readline, b''):
+            if not line.endswith(b'\n'):
+                # Still being written, taken in once it is finished
+                break
+            start, position = position, position + len(line)
+            line = line.rstrip(b'\r\n')
+            if not line:
+                continue
+            values = _leading_values(line, leading)
+            if values is None:
+                return False
+            key = values[key_index]
+            if totaled:
+                # The row replaced or deleted no longer counts
+                old = by_key.get(key)
+                if old is not None:
+                    group, amount = (_leading_values(mapped[old:mapped.find(b'\n', old)].rstrip(b'\r'),
+                                                     leading)[column] for column in totaled)
+                    totals[group] -= int(amount or 0)
+            # Nothing but the key and separators: a tombstone
+            if len(line) == len(key) + width - 1 and line.count(b',') == width - 1:
+                by_key.pop(key, None)
+                continue
+            by_key[key] = start
+            for column, index in fields:
+                index.setdefault(values[column], []).append(key)
+            if totaled:
+                group, amount = (values[column] for column in totaled)
+                totals[group] = totals.get(group, 0) + int(amount or 0)
+        self.size = position
+        return True
+
+def _leading_values(line: bytes, leading: int) -> Optional[List[bytes]]:
+    """Split a CSV line into at least its first leading values and the rest,
+    or return None if it cannot be split without the csv module."""
+    values = line.split(b',', leading)
+    if b'"' in line:
+        if line.count(b'"') % 2:
+            return None
+        # Only quoted values among the ones we look at need the csv module
+        rest = len(values[leading]) + 1 if len(values) > leading else 0
+        if b'"' in line[:len(line) - rest]:
+            values = [value.encode('utf-8') for value in next(csv.reader([line.decode('utf-8')]))]
+    return values if len(values) >= leading else None
+
+def _drop_torn_line(filename: str):
+    """Cut off the last line of a file if it was left unfinished."""
+    try:
+        f = open(filename, 'rb+')
+    except FileNotFoundError:
+        return
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        with mmap.mmap(f.fileno(), 0) as mapped:
+            end = mapped.rfind(b'\n') + 1
+        # Not even the header is finished: leave it to whoever reads it
+        if 0 < end < size:
+            f.truncate(end)
+
+def _partition_name(scheme: str, showing_id: str, theatre_id: str) -> str:
+    """Name the partition of a showing's bookings, safe to use as a file name."""
+    name = f"showing_{showing_id}" if scheme == 'showing' else f"theatre_{theatre_id}"
+    return re.sub(r'[^\w-]', '_', name)
+
+class _Partitions:
+    """Where the rows of a partitioned table are, as of a table signature."""
+    __slots__ = ('signature', 'manifest', 'by_key', 'files', 'live', 'dead')
+
+    def __init__(self, signature: Hashable, manifest: Dict[str, str]):
+        self.signature = signature
+        # Showing id -> partition
+        self.manifest = manifest
+        # Primary key -> partition holding the row
+        self.by_key: Dict[str, str] = {}
+        # Partition -> (size, inode) of its file when last read or written
+        self.files: Dict[str, Tuple[int, int]] = {}
+        # Partition -> live rows, and dead rows left in its file
+        self.live: Dict[str, int] = {}
+        self.dead: Dict[str, int] = {}
+
+    def put(self, row_id: str, partition: str):
+        """Account for a row written to partition, new or replacing an old version."""
+        old = self.by_key.get(row_id)
+        if old is not None:
+            self.live[old] -= 1
+            # Moved rows also leave a tombstone behind
+            self.dead[old] = self.dead.get(old, 0) + (1 if old == partition else 2)
+        self.by_key[row_id] = partition
+        self.live[partition] = self.live.get(partition, 0) + 1
+
+    def drop(self, row_id: str):
+        """Account for a row deleted by a tombstone."""
+        partition = self.by_key.pop(row_id, None)
+        if partition is not None:
+            self.live[partition] -= 1
+            self.dead[partition] = self.dead.get(partition, 0) + 2
+
+class CSVBackend(StorageBackend):
+    """One CSV file per table, as listed in CSV_FILES.
+
+    Each table has a lock file next to it (e.g. bookings.csv.lock), locked
+    shared while the table is read and exclusive while it is written. It
+    also holds the table's version, a counter bumped by every write, so
+    writers in other processes can tell that their copy went stale, and a
+    count of the times a file of the table was rewritten whole, so readers
+    only take in rows appended to the file they read before. Both lead the
+    table's signature. Last comes a flag set while changes to the table are
+    logged but not applied yet: whoever next locks the table exclusively
+    and finds it still set, because the writer died in between, replays
+    the log onto the table first.
+
+    Changes are logged to a write-ahead log (WAL_PATH for the default files,
+    none for other files unless wal_path is given) before they are applied,
+    so changes to several tables survive a crash together. A log line is
+    a CRC-32 of its JSON record, then the record: {"table": [inserted rows,
+    updated rows, deleted keys]} with rows as lists of stored text.
+
+    Bookings are partitioned as BOOKING_PARTITIONS says for the default
+    files, and as partitions says (default 'none') for other files. The
+    manifest (bookings/manifest.csv) lists showing_id,partition and its
+    signature, with the version, stands for the whole table's.
+    """
+
+    def __init__(self, files: Optional[Dict[str, str]] = None, wal_path: Optional[str] = None,
+                 partitions: Optional[str] = None):
+        self.files = dict(CSV_FILES if files is None else files)
+        self.wal_path = WAL_PATH if files is None and wal_path is None else wal_path
+        if partitions is None:
+            partitions = BOOKING_PARTITIONS if files is None else 'none'
+        # Partitioned tables -> scheme
+        self.partitioned = {'bookings': partitions} if partitions != 'none' and 'bookings' in self.files else {}
+        self._partitions: Dict[str, _Partitions] = {}
+        self._writers: Optional[ThreadPoolExecutor] = None
+        # Append-only table files: filename -> offsets of their rows
+        self._offsets: Dict[str, _RowOffsets] = {}
+        self._offsets_lock = threading.Lock()
+        # Append-only tables: table -> (table signature, dead rows in that
+        # file, live rows in it or None if not known)
+        self._dead_rows: Dict[str, Tuple[Hashable, int, Optional[int]]] = {}
+        self._sequence_lock = threading.Lock()
+        # Without fcntl, what keeps the threads of this process out of a table
+        self._thread_locks = {table: threading.Lock() for table in self.files}
+        self._wal_lock = threading.Lock()
+        # Per thread: table -> (lock file descriptor, locked exclusively)
+        self._local = threading.local()
+
+    @contextmanager
+    def _lock(self, table: str, exclusive: bool):
+        """Lock a table against other threads and processes.
+        
+        Reentrant within a thread; a thread holding the shared lock must not
+        ask for the exclusive one.
+        """
+        held = self._local.__dict__.setdefault('held', {})
+        if table in held:
+            if exclusive and not held[table][1]:
+                raise RuntimeError(f"Cannot upgrade the shared lock on {table}")
+            yield held[table][0]
+            return
+
+        with nullcontext() if fcntl is not None else self._thread_locks[table]:
+            fd = os.open(self.files[table] + '.lock', os.O_RDWR | os.O_CREAT | _O_BINARY, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                held[table] = (fd, exclusive)
+                try:
+                    if exclusive and self.wal_path is not None and self._read_lock_file(fd)[2]:
+                        self._finish_logged_write(table, fd)
+                    yield fd
+                finally:
+                    del held[table]
+            finally:
+                # Closing the descriptor releases the lock
+                os.close(fd)
+
+    @staticmethod
+    def _read_lock_file(fd: int) -> Tuple[int, int, int]:
+        """Return a table's version, rewrite count and logged-but-not-applied
+        flag from its lock file."""
+        # Every lock opens its own descriptor, so seeking it affects no other thread
+        os.lseek(fd, 0, os.SEEK_SET)
+        numbers = [int(text) for text in os.read(fd, 64).split()]
+        # Older lock files hold just the version, or no flag
+        version, rewrites, logged = (numbers + [0, 0, 0])[:3]
+        return version, rewrites, logged
+
+    @staticmethod
+    def _write_lock_file(fd: int, version: int, rewrites: int, logged: int):
+        # Fixed width, so one small write replaces the old numbers in place
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, f"{version:020d} {rewrites:020d} {logged:d}\n".encode())
+
+    def _read_counters(self, fd: int) -> Tuple[int, int]:
+        """Return a table's (version, rewrites), which lead its signature."""
+        return self._read_lock_file(fd)[:2]
+
+    def _bump_version(self, table: str, fd: int, rewritten: bool = False) -> Tuple[int, int]:
+        """Advance a table's version, and its rewrite count if a file of it
+        was rewritten whole, clearing the logged flag; the caller holds its
+        exclusive lock. Returns both counters."""
+        version, rewrites, _ = self._read_lock_file(fd)
+        version, rewrites = version + 1, rewrites + rewritten
+        self._write_lock_file(fd, version, rewrites, 0)
+        return version, rewrites
+
+    def _mark_logged(self, lock_fd: int):
+        """Flag a table as having changes logged that are not applied yet,
+        before logging them; applying them bumps the version, clearing it."""
+        if self.wal_path is not None:
+            self._write_lock_file(lock_fd, *self._read_counters(lock_fd), 1)
+
+    def _finish_logged_write(self, table: str, lock_fd: int):
+        """Replay the log onto a table whose writer died after logging
+        changes to it but before applying them; the caller holds its
+        exclusive lock. The version is bumped either way, so writers with a
+        copy from before find it stale instead of writing over the changes."""
+        self._replay([table])
+        self._bump_version(table, lock_fd)
+
+    def _append_files(self, table: str) -> List[str]:
+        """Return the files an append-only table's rows are appended to."""
+        if table in self.partitioned and self.exists(table):
+            return [self._partition_file(table, partition)
+                    for partition in sorted(set(self._read_manifest(table)[1].values()))]
+        return [self.files[table]]
+
+    def _table_file(self, table: str) -> str:
+        """Return the file whose signature stands for the table's: the
+        table's CSV file, or the manifest of a partitioned table."""
+        if table in self.partitioned:
+            return os.path.join(os.path.splitext(self.files[table])[0], 'manifest.csv')
+        return self.files[table]
+
+    def _partition_file(self, table: str, partition: str) -> str:
+        return os.path.join(os.path.splitext(self.files[table])[0], partition + '.csv')
+
+    def exists(self, table: str) -> bool:
+        return os.path.exists(self._table_file(table))
+
+    def signature(self, table: str) -> Hashable:
+        with self._lock(table, exclusive=False) as fd:
+            return self._read_counters(fd) + _file_signature(os.stat(self._table_file(table)))
+
+    def load(self, table: str) -> Tuple[Hashable, List[Record]]:
+        with self._lock(table, exclusive=False) as lock_fd:
+            loaded = self._load_snapshot(table, lock_fd) if SNAPSHOTS else None
+            if loaded is not None:
+                return loaded
+            if table in self.partitioned:
+                return self._load_partitions(table, lock_fd)
+            with open(self.files[table], 'r', newline='') as f:
+                # Take the signature from the open handle so it matches what we parse
+                signature = self._read_counters(lock_fd) + _file_signature(os.fstat(f.fileno()))
+                reader = csv.reader(f)
+                rows = _positional_rows(table, next(reader, []), reader)
+                if table in APPEND_ONLY_TABLES:
+                    # Fold before parsing so dead rows are never turned into records
+                    rows, dead_rows = _fold_rows(table, rows)
+                    self._dead_rows[table] = (signature, dead_rows, len(rows))
+                return signature, RECORD_TYPES[table].from_rows(rows)
+
+    def _snapshot_file(self, table: str) -> str:
+        return os.path.splitext(self.files[table])[0] + '.snap'
+
+    def _load_snapshot(self, table: str, lock_fd: int) -> Optional[Tuple[Hashable, List[Record]]]:
+        """Load a table from its snapshot, plus the rows appended since for an
+        append-only table. Returns None if the snapshot cannot tell the
+        current contents of the table."""
+        try:
+            f = open(self._snapshot_file(table), 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            header = _read_snapshot_header(f)
+            if header is None or header[0] != table or list(header[1]) != CSV_HEADERS[table]:
+                return None
+            signature = tuple(header[2])
+            current = self._read_counters(lock_fd) + _file_signature(os.stat(self._table_file(table)))
+            if current != signature and table not in APPEND_ONLY_TABLES:
+                return None
+            offset = f.tell()
+            try:
+                # Unmarshalled straight from the page cache, without reading it into a buffer first
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+                        memoryview(mapped) as view, view[offset:] as data:
+                    body = marshal.loads(data)
+            except (EOFError, ValueError, TypeError):
+                return None
+
+        if table in self.partitioned:
+            state = self._partitions[table] = _Partitions(signature, body['partitions'][0])
+            state.by_key, state.files, state.live, state.dead = body['partitions'][1:]
+        elif table in APPEND_ONLY_TABLES:
+            self._dead_rows[table] = (signature, body['dead'], len(body['values'][0]))
+        tail = None
+        if current != signature:
+            tail = self._read_tail(table, signature, lock_fd)
+            if tail is None:
+                return None
+            signature = tail[0]
+
+        record_type = RECORD_TYPES[table]
+        records = record_type.from_columns(body['values'])
+        if tail is not None and (tail[1] or tail[2]):
+            key_index = record_type.FIELDS.index(PRIMARY_KEYS[table])
+            key, parse = attrgetter(record_type.ATTRIBUTES[key_index]), record_type.PARSERS[key_index]
+            live = {key(row): row for row in records}
+            for row in tail[1]:
+                live[key(row)] = row
+            for row_id in tail[2]:
+                live.pop(parse(row_id), None)
+            records = list(live.values())
+        return signature, records
+
+    def snapshot(self, table: str) -> bool:
+        """Write a snapshot of a table unless the one there is current.
+        Returns whether one was written."""
+        with self._lock(table, exclusive=False) as lock_fd:
+            current = self._read_counters(lock_fd) + _file_signature(os.stat(self._table_file(table)))
+            try:
+                with open(self._snapshot_file(table), 'rb') as f:
+                    header = _read_snapshot_header(f)
+            except FileNotFoundError:
+                header = None
+            if header is not None and header[0] == table and tuple(header[2]) == current \
+                    and list(header[1]) == CSV_HEADERS[table]:
+                return False
+
+            signature, records = self.load(table)
+            record_type = RECORD_TYPES[table]
+            # Column by column, in the records' own types, so loading needs no parsing
+            body = {'values': record_type.to_columns(records)}
+            if table in self.partitioned:
+                state = self._partitions[table]
+                body['partitions'] = (state.manifest, state.by_key, state.files, state.live, state.dead)
+            elif table in APPEND_ONLY_TABLES:
+                body['dead'] = self._dead_rows.get(table, (None, 0, None))[1]
+            header = marshal.dumps((table, CSV_HEADERS[table], signature))
+            with atomic_open(self._snapshot_file(table), 'wb') as f:
+                f.write(_SNAPSHOT_PREFIX.pack(_SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, len(header)))
+                f.write(header)
+                f.write(marshal.dumps(body))
+            return True
+
+    def find(self, table, field, value):
+        # Append-only files are looked up through offsets of their rows,
+        # decoding just the rows found
+        if table not in APPEND_ONLY_TABLES or (field != PRIMARY_KEYS[table]
+                                               and field not in INDEXED_FIELDS.get(table, ())):
+            return None
+        with self._lock(table, exclusive=False):
+            filenames = [self.files[table]]
+            if table in self.partitioned:
+                manifest = self._read_manifest(table)[1]
+                if field == 'showing_id':
+                    # A showing's rows are all in one partition, no need to read the others
+                    partitions = [manifest[value]] if value in manifest else []
+                else:
+                    partitions = sorted(set(manifest.values()))
+                filenames = [self._partition_file(table, partition) for partition in partitions]
+            rows = []
+            for filename in filenames:
+                found = self._find_in_file(table, filename, field, value)
+                if found is None:
+                    return None
+                rows.extend(found)
+        record_type = RECORD_TYPES[table]
+        records = record_type.from_rows(rows)
+        records.sort(key=attrgetter(record_type.ATTRIBUTES[record_type.FIELDS.index(PRIMARY_KEYS[table])]))
+        return records
+
+    def _find_in_file(self, table: str, filename: str, field: str, value: str) -> Optional[List[List[str]]]:
+        """Return the rows of an append-only table file whose field equals
+        value, or None if its rows cannot be indexed by offset."""
+        column = CSV_HEADERS[table].index(field)
+        width = len(CSV_HEADERS[table])
+
+        def rows_found(mapped: mmap.mmap, offsets: _RowOffsets) -> List[List[str]]:
+            wanted = value.encode('utf-8')
+            keys = [wanted] if field == PRIMARY_KEYS[table] else offsets.by_field[field].get(wanted, ())
+            rows = []
+            for start in sorted({offsets.by_key[key] for key in keys if key in offsets.by_key}):
+                line = mapped[start:mapped.find(b'\n', start)].decode('utf-8')
+                row = next(csv.reader([line]))
+                # A key may have been listed under a value its row no longer has
+                if len(row) > column and row[column] == value:
+                    rows.append((row + [''] * width)[:width])
+            return rows
+
+        return self._with_offsets(table, filename, rows_found, [])
+
+    def totals(self, table):
+        # Summed up as append-only files are scanned for the offsets of their rows
+        if table not in APPEND_ONLY_TABLES or table not in TOTALED_FIELDS:
+            return None
+        with self._lock(table, exclusive=False):
+            totals: Dict[str, int] = {}
+            for filename in self._append_files(table):
+                found = self._with_offsets(table, filename, lambda mapped, offsets: list(offsets.totals.items()), [])
+                if found is None:
+                    return None
+                for group, total in found:
+                    group = group.decode('utf-8')
+                    totals[group] = totals.get(group, 0) + total
+        return totals
+
+    def _with_offsets(self, table: str, filename: str, use: Callable[[mmap.mmap, _RowOffsets], list],
+                      empty: list) -> Optional[list]:
+        """Map an append-only table file and return use(mapped file, its row
+        offsets), called under _offsets_lock once the offsets took in every
+        row. Returns empty for a file without rows, and None if its rows
+        cannot be indexed by offset. The caller holds the table's lock."""
+        try:
+            f = open(filename, 'rb')
+        except FileNotFoundError:
+            return empty
+        with f, self._lock(table, exclusive=False) as lock_fd:
+            rewrites = self._read_counters(lock_fd)[1]
+            stat_result = os.fstat(f.fileno())
+            header = f.readline()
+            if next(csv.reader([header.decode('utf-8')]), []) != CSV_HEADERS[table]:
+                return None
+            if stat_result.st_size == len(header):
+                return empty
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, self._offsets_lock:
+                offsets = self._row_offsets(table, filename, rewrites, stat_result.st_ino, mapped, len(header))
+                return None if offsets is None else use(mapped, offsets)
+
+    def _row_offsets(self, table: str, filename: str, rewrites: int, inode: int, mapped: mmap.mmap,
+                     start: int) -> Optional[_RowOffsets]:
+        """Return the row offsets of a mapped table file, first taking in the
+        rows added since they were last used; the caller holds _offsets_lock."""
+        offsets = self._offsets.get(filename)
+        # Rewritten (compacted) files start over, even if they got the old inode back
+        if offsets is None or (offsets.rewrites, offsets.inode) != (rewrites, inode) \
+                or offsets.size > len(mapped):
+            offsets = _RowOffsets(table, rewrites, inode, start)
+        if not offsets.scan(mapped):
+            self._offsets.pop(filename, None)
+            return None
+        self._offsets[filename] = offsets
+        return offsets
+
+    def load_since(self, table, signature):
+        if table not in APPEND_ONLY_TABLES:
+            return None
+        with self._lock(table, exclusive=False) as lock_fd:
+            return self._read_tail(table, signature, lock_fd)
+
+    def _read_tail(self, table: str, signature: Hashable, lock_fd: int):
+        """load_since, for a caller holding the table's lock."""
+        if table in self.partitioned:
+            return self._load_partitions_since(table, signature, lock_fd)
+        with open(self.files[table], 'rb') as f:
+            current = self._read_counters(lock_fd) + _file_signature(os.fstat(f.fileno()))
+            # Only appended to if the file was not rewritten since, and is at least as long
+            _, rewrites, _, size, inode = signature
+            if current[1] != rewrites or current[4] != inode or current[3] < size:
+                return None
+            rows, deleted, dead_rows = _split_tail(table, _read_rows(table, f, size))
+            known = self._dead_rows.get(table)
+            if known and known[0] == signature:
+                live_rows = None if known[2] is None else max(known[2] + len(rows) - len(deleted), 0)
+                self._dead_rows[table] = (current, known[1] + dead_rows, live_rows)
+            return current, RECORD_TYPES[table].from_rows(rows), deleted
+
+    def write_changes(self, table, expected, inserted, updated, deleted, all_rows):
+        with self._lock(table, exclusive=True) as lock_fd:
+            if self.signature(table) != expected:
+                raise StaleWriteError(table)
+            self._mark_logged(lock_fd)
+            self._log({table: (inserted, updated, deleted)})
+            after = self._apply(table, expected, inserted, updated, deleted, all_rows, lock_fd)
+        self._checkpoint_if_due()
+        return after
+
+    def write_batch(self, changes):
+        with self.transaction():
+            for table, (expected, *_) in changes.items():
+                if self.signature(table) != expected:
+                    raise StaleWriteError(table)
+            for table in changes:
+                with self._lock(table, exclusive=True) as lock_fd:
+                    self._mark_logged(lock_fd)
+            # One log record for the lot: after a crash all of it is replayed
+            self._log({table: (inserted, updated, deleted)
+                       for table, (_, inserted, updated, deleted, _) in changes.items()})
+            signatures = {}
+            for table, args in changes.items():
+                with self._lock(table, exclusive=True) as lock_fd:
+                    signatures[table] = self._apply(table, *args, lock_fd)
+            self._checkpoint_if_due()
+        return signatures
+
+    def _apply(self, table, expected, inserted, updated, deleted, all_rows, lock_fd) -> Hashable:
+        """Write logged changes to a table file; the caller holds its exclusive lock."""
+        if table in self.partitioned:
+            return self._apply_partitions(table, expected, inserted, updated, deleted, all_rows, lock_fd)
+        if (updated or deleted) and table not in APPEND_ONLY_TABLES:
+            return self._rewrite(table, all_rows(), lock_fd)
+
+        appended = ([row.values() for row in inserted] + [row.values() for row in updated]
+                    + [_tombstone(table, row_id) for row_id in deleted])
+        after = self._bump_version(table, lock_fd) + self._append(self.files[table], appended)
+
+        if table in APPEND_ONLY_TABLES:
+            # Every update leaves the old version behind, every tombstone
+            # leaves itself and the row it deletes
+            known = self._dead_rows.get(table)
+            if not known or known[0] != expected:
+                known = (expected, 0, None)
+            dead_rows = known[1] + len(updated) + 2 * len(deleted)
+            live_rows = None if known[2] is None else max(known[2] + len(inserted) - len(deleted), 0)
+            if dead_rows >= COMPACT_MIN_DEAD_ROWS and live_rows is None:
+                # Counted once, kept up to date from then on
+                live_rows = len(all_rows())
+            self._dead_rows[table] = (after, dead_rows, live_rows)
+            if dead_rows >= COMPACT_MIN_DEAD_ROWS and dead_rows >= COMPACT_RATIO * live_rows:
+                return self._rewrite(table, all_rows(), lock_fd)
+        return after
+
+    @contextmanager
+    def transaction(self):
+        # Lock every table, always in the same order so two transactions
+        # cannot each hold a lock the other is waiting for
+        with ExitStack() as stack:
+            for table in sorted(self.files):
+                stack.enter_context(self._lock(table, exclusive=True))
+            yield
+
+    def compact(self, table, all_rows):
+        with self._lock(table, exclusive=True) as lock_fd:
+            if table in self.partitioned:
+                state = self._partitions.get(table)
+                if state is None or state.signature != self.signature(table):
+                    return 0
+                dropped = sum(state.dead.values())
+                if dropped:
+                    self._rewrite_partitions(table, state, all_rows(), [p for p, dead in state.dead.items() if dead])
+                    state.signature = self._bump_version(table, lock_fd, rewritten=True) + state.signature[2:]
+                return dropped
+            known = self._dead_rows.get(table)
+            if not known or not known[1] or known[0] != self.signature(table):
+                return 0
+            self._rewrite(table, all_rows(), lock_fd)
+            return known[1]
+
+    def _log(self, changes: Dict[str, Tuple[List[Record], List[Record], List[str]]]):
+        """Append a record of changes to the write-ahead log, durably per FSYNC_POLICY."""
+        if self.wal_path is None:
+            return
+        payload = json.dumps({
+            table: [[row.values() for row in inserted], [row.values() for row in updated], list(deleted)]
+            for table, (inserted, updated, deleted) in changes.items()
+        }, separators=(',', ':')).encode('utf-8')
+        with self._wal_lock:
+            fd = os.open(self.wal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | _O_BINARY, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                # One write per record, so a crash can only tear the last one
+                os.write(fd, b'%08x %s\n' % (zlib.crc32(payload), payload))
+                _sync_written(self.wal_path, fd)
+            finally:
+                os.close(fd)
+
+    def _read_log(self) -> List[Dict[str, list]]:
+        """Return the records in the write-ahead log, up to a torn or corrupt one."""
+        records = []
+        with open(self.wal_path, 'rb') as f:
+            for line in f:
+                checksum, _, payload = line.rstrip(b'\n').partition(b' ')
+                if not line.endswith(b'\n') or checksum != b'%08x' % zlib.crc32(payload):
+                    break
+                records.append(json.loads(payload))
+        return records
+
+    def _checkpoint_if_due(self):
+        try:
+            due = self.wal_path is not None and os.path.getsize(self.wal_path) > WAL_CHECKPOINT_BYTES
+        except OSError:
+            due = False
+        if due:
+            self.checkpoint()
+
+    def checkpoint(self) -> int:
+        """Replay the write-ahead log onto the tables, make the table files
+        durable, empty the log and bring the snapshots up to date.
+
+        The log is replayed even while every process is alive: one that
+        crashed partway through a write left it complete only in the log.
+        Returns the number of records replayed.
+        """
+        if self.wal_path is None:
+            return 0
+        with self.transaction():
+            replayed = self._replay()
+            files = [*self.files.values()]
+            for table in self.partitioned:
+                directory = os.path.dirname(self._table_file(table))
+                if os.path.isdir(directory):
+                    files.extend(os.path.join(directory, name) for name in os.listdir(directory))
+            for path in {*files, *(os.path.dirname(os.path.abspath(filename)) for filename in files)}:
+                if os.path.exists(path):
+                    _fsync_path(path)
+            with self._wal_lock:
+                fd = os.open(self.wal_path, os.O_WRONLY | os.O_CREAT | _O_BINARY, 0o644)
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(fd, fcntl.LOCK_EX)
+                    os.ftruncate(fd, 0)
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            if SNAPSHOTS:
+                for table in self.files:
+                    if self.exists(table):
+                        self.snapshot(table)
+        return replayed
+
+    def recover(self) -> int:
+        """Replay the write-ahead log onto the tables after a crash, then
+        checkpoint; see checkpoint. Returns the number of records replayed."""
+        # Even with nothing to replay, the checkpoint brings the snapshots up to date
+        return self.checkpoint()
+
+    def _replay(self, only: Optional[Iterable[str]] = None) -> int:
+        """Apply the records in the write-ahead log to the tables, or to only
+        the given ones; the caller holds their exclusive locks.
+
+        Records carry whole rows, so replaying records that did reach the
+        tables is harmless: either way the tables end up as the last record
+        left them, and only tables that replay changed are rewritten.
+        Returns the number of records replayed.
+        """
+        records = self._read_log() if os.path.exists(self.wal_path) else []
+        replayed = set(self.files if only is None else only)
+        tables: Dict[str, Dict[str, Record]] = {}
+        stored_rows: Dict[str, Dict[str, Record]] = {}
+        for record in records:
+            for table, (inserted, updated, deleted) in record.items():
+                if table not in replayed:
+                    continue
+                if table not in tables:
+                    if table in APPEND_ONLY_TABLES:
+                        # Appends are not synced before a checkpoint: a crash may
+                        # have cut one short, while its rows are in the log
+                        for filename in self._append_files(table):
+                            _drop_torn_line(filename)
+                    key = PRIMARY_KEYS[table]
+                    stored = self.load(table)[1] if self.exists(table) else []
+                    stored_rows[table] = {row[key]: row for row in stored}
+                    tables[table] = dict(stored_rows[table])
+                rows, record_type, key = tables[table], RECORD_TYPES[table], PRIMARY_KEYS[table]
+                for row in map(record_type.from_values, inserted):
+                    rows[row[key]] = row
+                for row in map(record_type.from_values, updated):
+                    if row[key] in rows:
+                        rows[row[key]] = row
+                for row_id in deleted:
+                    rows.pop(row_id, None)
+        for table, rows in tables.items():
+            if rows == stored_rows[table]:
+                continue
+            with self._lock(table, exclusive=True) as lock_fd:
+                self._rewrite(table, list(rows.values()), lock_fd)
+        return len(records)
+
+    def reserve_ids(self, table, count):
+        # The next free key lives in a sidecar file next to the table,
+        # e.g. bookings.csv.seq, locked while it is being advanced
+        path = self.files[table] + '.seq'
+        with self._sequence_lock:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            with os.fdopen(fd, 'r+') as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                text = f.read().strip()
+                if text:
+                    start = int(text)
+                else:
+                    # First use, or the sidecar was lost: continue after the table
+                    start = _max_numeric_id(table, self.load(table)[1]) + 1
+                f.seek(0)
+                f.truncate()
+                f.write(f"{start + count}\n")
+                f.flush()
+                _sync_written(path, f.fileno())
+        return start
+
+    def create_missing(self, seed):
+        for table, filename in self.files.items():
+            with self._lock(table, exclusive=True) as lock_fd:
+                if self.exists(table):
+                    continue
+                if table in self.partitioned and os.path.exists(filename):
+                    # Kept in one file so far: split it up
+                    with open(filename, 'rb') as f:
+                        rows, _ = _fold_rows(table, _read_rows(table, f))
+                    self._rewrite(table, RECORD_TYPES[table].from_rows(rows), lock_fd)
+                    os.remove(filename)
+                else:
+                    self._rewrite(table, to_records(table, seed.get(table, [])), lock_fd)
+        self.recover()
+
+    def _rewrite(self, table: str, rows: List[Record], lock_fd: int) -> Hashable:
+        """Replace a whole table file with rows; the caller holds its exclusive lock."""
+        if table in self.partitioned:
+            return self._rewrite_table_partitions(table, rows, lock_fd)
+        signature = self._bump_version(table, lock_fd, rewritten=True) + self._write_file(self.files[table], table, rows)
+        if table in APPEND_ONLY_TABLES:
+            self._dead_rows[table] = (signature, 0, len(rows))
+        return signature
+
+    def _write_file(self, filename: str, table: str, rows: List[Record]) -> Hashable:
+        with atomic_open(filename) as f:
+            writer = csv.writer(f)
+            # Always write headers
+            writer.writerow(CSV_HEADERS[table])
+            writer.writerows(row.values() for row in rows)
+            f.flush()
+            # The temp file keeps its inode and mtime when renamed into place
+            return _file_signature(os.fstat(f.fileno()))
+
+    def _append(self, filename: str, rows: List[List[str]]) -> Hashable:
+        """Append CSV rows to a table file. Returns its file signature after."""
+        with open(filename, 'rb') as f:
+            # A hand-edited file may be missing its final line break
+            needs_newline = False
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b'\n'
+
+        with open(filename, 'a', newline='') as f:
+            if needs_newline:
+                f.write('\r\n')
+            csv.writer(f).writerows(rows)
+            f.flush()
+            # With a log the rows are already durable there, and the file is
+            # synced at the next checkpoint
+            if self.wal_path is None:
+                _sync_written(filename, f.fileno())
+            return _file_signature(os.fstat(f.fileno()))
+
+    # Partitioned tables
+
+    def _read_manifest(self, table: str) -> Tuple[Hashable, Dict[str, str]]:
+        """Return the file signature of a table's manifest and the partition of each showing."""
+        with open(self._table_file(table), 'r', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            return _file_signature(os.fstat(f.fileno())), {row[0]: row[1] for row in reader if len(row) >= 2}
+
+    def _write_manifest(self, table: str, manifest: Dict[str, str]) -> Hashable:
+        with atomic_open(self._table_file(table)) as f:
+            writer = csv.writer(f)
+            writer.writerow(['showing_id', 'partition'])
+            writer.writerows(manifest.items())
+            f.flush()
+            return _file_signature(os.fstat(f.fileno()))
+
+    def _route(self, table: str, manifest: Dict[str, str], rows: Iterable[Record]) -> Dict[str, str]:
+        """Return the manifest with a partition for the showing of every row,
+        adding any showings it is missing to a copy."""
+        missing = {row['showing_id'] for row in rows} - manifest.keys()
+        if not missing:
+            return manifest
+        scheme = self.partitioned[table]
+        theatres = {}
+        if scheme == 'theatre' and 'movies_showings' in self.files and self.exists('movies_showings'):
+            theatres = {showing['id']: showing.theatre_id for showing in self.load('movies_showings')[1]
+                        if showing['id'] in missing}
+        manifest = dict(manifest)
+        for showing_id in sorted(missing):
+            manifest[showing_id] = _partition_name(scheme, showing_id, theatres.get(showing_id, ''))
+        return manifest
+
+    def _each_partition(self, func: Callable, items: Iterable[tuple]) -> list:
+        """Call func(*item) for every item, partitions in parallel when there are several."""
+        items = list(items)
+        if len(items) < 2:
+            return [func(*item) for item in items]
+        if self._writers is None:
+            self._writers = ThreadPoolExecutor(PARTITION_WRITERS, thread_name_prefix='pvc-partition')
+        return list(self._writers.map(lambda item: func(*item), items))
+
+    def _load_partitions(self, table: str, lock_fd: int) -> Tuple[Hashable, List[Record]]:
+        manifest_signature, manifest = self._read_manifest(table)
+        state = _Partitions(self._read_counters(lock_fd) + manifest_signature, manifest)
+        key_index = CSV_HEADERS[table].index(PRIMARY_KEYS[table])
+        rows = []
+        for partition in sorted(set(manifest.values())):
+            try:
+                with open(self._partition_file(table, partition), 'rb') as f:
+                    live, state.dead[partition] = _fold_rows(table, _read_rows(table, f))
+                    state.files[partition] = _file_signature(os.fstat(f.fileno()))[1:]
+            except FileNotFoundError:
+                continue
+            state.live[partition] = len(live)
+            for row in live:
+                state.by_key[row[key_index]] = partition
+            rows.extend(live)
+        self._partitions[table] = state
+        records = RECORD_TYPES[table].from_rows(rows)
+        # In key order, as if they had been read from a single file
+        record_type = RECORD_TYPES[table]
+        records.sort(key=attrgetter(record_type.ATTRIBUTES[record_type.FIELDS.index(PRIMARY_KEYS[table])]))
+        return state.signature, records
+
+    def _load_partitions_since(self, table, signature, lock_fd):
+        state = self._partitions.get(table)
+        if state is None or state.signature != signature:
+            return None
+        manifest_signature, manifest = self._read_manifest(table)
+        current = self._read_counters(lock_fd) + manifest_signature
+        # A partition file rewritten since may be shorter, or even longer, than the one read
+        if current[1] != signature[1]:
+            return None
+        key_index = CSV_HEADERS[table].index(PRIMARY_KEYS[table])
+        tails, dead = [], {}
+        for partition in sorted(set(manifest.values())):
+            try:
+                stat_result = os.stat(self._partition_file(table, partition))
+            except FileNotFoundError:
+                continue
+            known = state.files.get(partition)
+            if known == (stat_result.st_size, stat_result.st_ino):
+                continue
+            # Only appended to if it is the same file, at least as long
+            if known is not None and (known[1] != stat_result.st_ino or known[0] > stat_result.st_size):
+                return None
+            with open(self._partition_file(table, partition), 'rb') as f:
+                appended = list(_read_rows(table, f, known[0] if known else 0))
+                rows, deleted, _ = _split_tail(table, appended)
+                tails.append((partition, _file_signature(os.fstat(f.fileno()))[1:], rows, deleted))
+            # Appended rows that are not live, plus the earlier rows they replaced or deleted
+            replaced = sum(state.by_key.get(row_id) == partition
+                           for row_id in [*(row[key_index] for row in rows), *deleted])
+            dead[partition] = state.dead.get(partition, 0) + len(appended) - len(rows) + replaced
+
+        changed, gone = [], []
+        # Deletions first, a row moved to another partition leaves a tombstone in its old one
+        for partition, file_signature, rows, deleted in tails:
+            state.files[partition] = file_signature
+            for row_id in deleted:
+                state.drop(row_id)
+            gone.extend(deleted)
+        for partition, file_signature, rows, deleted in tails:
+            for row in rows:
+                state.put(row[key_index], partition)
+            changed.extend(rows)
+        state.dead.update(dead)
+        state.manifest, state.signature = manifest, current
+        moved = {row[key_index] for row in changed}
+        return current, RECORD_TYPES[table].from_rows(changed), [row_id for row_id in gone if row_id not in moved]
+
+    def _partition_state(self, table: str, signature: Hashable, lock_fd: int) -> _Partitions:
+        """Return where the rows of a table are, reading it all if that is not known
+        as of signature, the table's current one."""
+        state = self._partitions.get(table)
+        if state is None or state.signature != signature:
+            self._load_partitions(table, lock_fd)
+            state = self._partitions[table]
+        return state
+
+    def _apply_partitions(self, table, expected, inserted, updated, deleted, all_rows, lock_fd) -> Hashable:
+        state = self._partition_state(table, expected, lock_fd)
+        key = PRIMARY_KEYS[table]
+        manifest = self._route(table, state.manifest, [*inserted, *updated])
+        appended: Dict[str, List[List[str]]] = {}
+        for row in [*inserted, *updated]:
+            partition, old = manifest[row['showing_id']], state.by_key.get(row[key])
+            if old is not None and old != partition:
+                appended.setdefault(old, []).append(_tombstone(table, row[key]))
+            appended.setdefault(partition, []).append(row.values())
+        for row_id in deleted:
+            if row_id in state.by_key:
+                appended.setdefault(state.by_key[row_id], []).append(_tombstone(table, row_id))
+
+        # New partitions get their file before the manifest points at it
+        for partition in appended.keys() - state.files.keys():
+            state.files[partition] = self._write_file(self._partition_file(table, partition), table, [])[1:]
+        manifest_signature = state.signature[2:]
+        if manifest is not state.manifest:
+            manifest_signature = self._write_manifest(table, manifest)
+        counters = self._bump_version(table, lock_fd)
+        written = self._each_partition(lambda partition, rows: self._append(self._partition_file(table, partition), rows),
+                                       appended.items())
+
+        for partition, file_signature in zip(appended, written):
+            state.files[partition] = file_signature[1:]
+        for row in [*inserted, *updated]:
+            state.put(row[key], manifest[row['showing_id']])
+        for row_id in deleted:
+            state.drop(row_id)
+        state.manifest, state.signature = manifest, counters + manifest_signature
+
+        # Compact partitions on their own, so a busy theatre never rewrites the others
+        due = [partition for partition in appended if state.dead.get(partition, 0) >= COMPACT_MIN_DEAD_ROWS
+               and state.dead[partition] >= COMPACT_RATIO * state.live.get(partition, 0)]
+        if due:
+            self._rewrite_partitions(table, state, all_rows(), due)
+            state.signature = self._bump_version(table, lock_fd, rewritten=True) + manifest_signature
+        return state.signature
+
+    def _rewrite_partitions(self, table: str, state: _Partitions, rows: List[Record], partitions: List[str]):
+        """Rewrite the files of some partitions with their share of rows, the
+        whole table's; the caller holds the table's exclusive lock."""
+        key = PRIMARY_KEYS[table]
+        shares = {partition: [] for partition in partitions}
+        for row in rows:
+            share = shares.get(state.by_key.get(row[key]))
+            if share is not None:
+                share.append(row)
+        written = self._each_partition(
+            lambda partition, share: self._write_file(self._partition_file(table, partition), table, share),
+            shares.items())
+        for partition, file_signature in zip(shares, written):
+            state.files[partition] = file_signature[1:]
+            state.dead[partition] = 0
+
+    def _rewrite_table_partitions(self, table: str, rows: List[Record], lock_fd: int) -> Hashable:
+        os.makedirs(os.path.dirname(self._table_file(table)), exist_ok=True)
+        manifest = self._route(table, self._read_manifest(table)[1] if self.exists(table) else {}, rows)
+        state = _Partitions(None, manifest)
+        key = PRIMARY_KEYS[table]
+        for row in rows:
+            state.put(row[key], manifest[row['showing_id']])
+        # Every partition is rewritten, emptied ones included
+        self._rewrite_partitions(table, state, rows, sorted(set(manifest.values())))
+        state.signature = self._bump_version(table, lock_fd, rewritten=True) + self._write_manifest(table, manifest)
+        self._partitions[table] = state
+        return state.signature
+
+class SQLiteBackend(StorageBackend):
+    """All tables in one SQLite database, in WAL mode so readers never block."""
+
+    # How hard SQLite syncs for each FSYNC_POLICY
+    SYNCHRONOUS = {'always': 'FULL', 'batch': 'NORMAL', 'never': 'OFF'}
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = SQLITE_PATH if path is None else path
+        # sqlite3 connections cannot be shared between threads
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f"PRAGMA synchronous={self.SYNCHRONOUS[FSYNC_POLICY]}")
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self._connection()
+        if self._local.depth:
+            # Nested, the outermost transaction commits
+            self._local.depth += 1
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn.execute('BEGIN IMMEDIATE')
+        self._local.depth = 1
+        try:
+            yield
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+        finally:
+            self._local.depth = 0
+
+    def signature(self, table: str) -> Hashable:
+        row = self._connection().execute(
+            'SELECT version FROM table_versions WHERE name = ?', (table,)).fetchone()
+        return row[0] if row else 0
+
+    def load(self, table: str) -> Tuple[Hashable, List[Record]]:
+        conn = self._connection()
+        record_type = RECORD_TYPES[table]
+        # Read the version and rows in one snapshot
+        with self._read_snapshot(conn):
+            signature = self.signature(table)
+            cursor = conn.execute(f"SELECT {self._columns(table)} FROM {table} ORDER BY rowid")
+            rows = [record_type.from_values(values) for values in cursor]
+        return signature, rows
+
+    def find(self, table: str, field: str, value: str) -> Optional[List[Record]]:
+        if field != PRIMARY_KEYS[table] and field not in INDEXED_FIELDS.get(table, ()):
+            return None
+        record_type = RECORD_TYPES[table]
+        cursor = self._connection().execute(
+            f'SELECT {self._columns(table)} FROM {table} WHERE "{field}" = ? ORDER BY rowid', (value,))
+        return [record_type.from_values(values) for values in cursor]
+
+    def totals(self, table):
+        if table not in TOTALED_FIELDS:
+            return None
+        group, summed = TOTALED_FIELDS[table]
+        cursor = self._connection().execute(
+            f'SELECT "{group}", SUM(CAST("{summed}" AS INTEGER)) FROM {table} GROUP BY "{group}"')
+        return {value: total for value, total in cursor}
+
+    def write_changes(self, table, expected, inserted, updated, deleted, all_rows):
+        conn = self._connection()
+        columns = CSV_HEADERS[table]
+        key = PRIMARY_KEYS[table]
+        placeholders = ', '.join('?' for _ in columns)
+        assignments = ', '.join(f'"{column}" = ?' for column in columns)
+
+        with self.transaction():
+            if self.signature(table) != expected:
+                raise StaleWriteError(table)
+            if inserted:
+                conn.executemany(
+                    f"INSERT INTO {table} ({self._columns(table)}) VALUES ({placeholders})",
+                    [row.values() for row in inserted])
+            if updated:
+                conn.executemany(
+                    f'UPDATE {table} SET {assignments} WHERE "{key}" = ?',
+                    [row.values() + [row[key]] for row in updated])
+            if deleted:
+                conn.executemany(f'DELETE FROM {table} WHERE "{key}" = ?',
+                                 [(row_id,) for row_id in deleted])
+            return self._bump_version(conn, table)
+
+    def reserve_ids(self, table, count):
+        conn = self._connection()
+        with self.transaction():
+            row = conn.execute('SELECT next_id FROM sequences WHERE name = ?', (table,)).fetchone()
+            if row:
+                start = row[0]
+            else:
+                start = _max_numeric_id(table, self.load(table)[1]) + 1
+            conn.execute('INSERT INTO sequences (name, next_id) VALUES (?, ?) '
+                         'ON CONFLICT(name) DO UPDATE SET next_id = excluded.next_id',
+                         (table, start + count))
+        return start
+
+    def create_missing(self, seed):
+        conn = self._connection()
+        with self.transaction():
+            existing = {name for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'")}
+            self._create_schema(conn)
+            for table, rows in seed.items():
+                if table not in existing and rows:
+                    self.replace_table(table, to_records(table, rows))
+
+    def replace_table(self, table: str, rows: List[Record]):
+        """Overwrite the whole table with rows."""
+        conn = self._connection()
+        columns = CSV_HEADERS[table]
+        placeholders = ', '.join('?' for _ in columns)
+        with self.transaction():
+            conn.execute(f"DELETE FROM {table}")
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {table} ({self._columns(table)}) VALUES ({placeholders})",
+                [row.values() for row in rows])
+            self._bump_version(conn, table)
+
+    def _create_schema(self, conn: sqlite3.Connection):
+        conn.execute('CREATE TABLE IF NOT EXISTS table_versions '
+                     '(name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS sequences '
+                     '(name TEXT PRIMARY KEY, next_id INTEGER NOT NULL)')
+        for table, columns in CSV_HEADERS.items():
+            definitions = ', '.join(
+                f'"{column}" TEXT NOT NULL DEFAULT \'\'' + (' PRIMARY KEY' if column == PRIMARY_KEYS[table] else '')
+                for column in columns)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definitions})")
+            # Columns added since the table was created
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for column in columns:
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN "{column}" TEXT NOT NULL DEFAULT \'\'')
+            for column in INDEXED_FIELDS.get(table, ()):
+                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table} ("{column}")')
+
+    @contextmanager
+    def _read_snapshot(self, conn: sqlite3.Connection):
+        if self._local.depth:
+            yield
+            return
+        conn.execute('BEGIN')
+        try:
+            yield
+        finally:
+            conn.execute('COMMIT')
+
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection, table: str) -> int:
+        conn.execute('INSERT INTO table_versions (name, version) VALUES (?, 1) '
+                     'ON CONFLICT(name) DO UPDATE SET version = version + 1', (table,))
+        return conn.execute('SELECT version FROM table_versions WHERE name = ?', (table,)).fetchone()[0]
+
+    @staticmethod
+    def _columns(table: str) -> str:
+        return ', '.join(f'"{column}"' for column in CSV_HEADERS[table])
+
+def open_backend(kind: Optional[str] = None) -> StorageBackend:
+    """Create the backend named by kind, or by STORAGE_BACKEND."""
+    kind = STORAGE_BACKEND if kind is None else kind
+    if kind == 'csv':
+        return CSVBackend()
+    if kind == 'sqlite':
+        return SQLiteBackend()
+    raise ValueError(f"Unknown storage backend: {kind}")
+
+def migrate_csv_to_sqlite(db_path: Optional[str] = None,
+                          files: Optional[Dict[str, str]] = None) -> Dict[str, int]:
+    """Copy every CSV table into a SQLite database. Returns rows copied per table."""
+    source = CSVBackend(files)
+    # Also replays the write-ahead log and splits up a bookings.csv not yet partitioned
+    source.create_missing({})
+    target = SQLiteBackend(db_path)
+    target.create_missing({})
+
+    copied = {}
+    with target.transaction():
+        for table in source.files:
+            if not source.exists(table):
+                continue
+            _, rows = source.load(table)
+            target.replace_table(table, rows)
+            copied[table] = len(rows)
+    return copied
+
+if __name__ == '__main__':
+    # python storage.py migrate [database path]
+    if len(sys.argv) >= 2 and sys.argv[1] == 'migrate':
+        counts = migrate_csv_to_sqlite(sys.argv[2] if len(sys.argv) > 2 else None)
+        for table, count in counts.items():
+            print(f"{table}: {count} row(s) copied")
+    else:
+        print("Usage: python storage.py migrate [database path]")
@@ -0,0 +1,49 @@
+"""Shared setup of the behaviour tests, which run on copies of the data files."""
+import importlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import handler
+import storage
+
+class DataDirTestCase(unittest.TestCase):
+    """Runs each test in a temporary copy of the data files."""
+
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.directory = temp.name
+        for name in os.listdir(ROOT):
+            if name.endswith('.csv'):
+                shutil.copy(os.path.join(ROOT, name), self.directory)
+        shutil.copytree(os.path.join(ROOT, 'bookings'), os.path.join(self.directory, 'bookings'))
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory)
+        # Start from a clean slate: no cached tables, locks or committer.
+        # Reloading keeps the module objects, so test modules see the new state
+        importlib.reload(storage)
+        importlib.reload(handler)
+        storage.FSYNC_POLICY = 'never'
+
+    def run_python(self, code: str, check: bool = True) -> subprocess.CompletedProcess:
+        """Run code in another process on the same data files."""
+        result = subprocess.run([sys.executable, '-c', code], cwd=self.directory, env=self.environment(),
+                                capture_output=True, text=True, timeout=120)
+        if check:
+            self.assertEqual(result.returncode, 0, result.stderr)
+        return result
+
+    def environment(self) -> dict:
+        """Environment of other processes: this project, on the CSV files."""
+        return dict(os.environ, PYTHONPATH=ROOT, PVC_STORAGE='csv')
+
+    def stored(self, table: str):
+        """Read a table straight from the files, through a backend of its own."""
+        return storage.CSVBackend().load(table)[1]
@@ -0,0 +1,40 @@
+"""Behaviour tests of the committer thread, which writes queued commits in batches.
+
+Run from the project root:
+
+    python -m unittest discover tests
+"""
+import unittest
+
+from support import DataDirTestCase, handler, storage
+
+class CommitterTest(DataDirTestCase):
+
+    def booking(self, user_id: str, seat: str) -> dict:
+        return {'booking_id': handler._next_id('bookings'), 'user_id': user_id, 'showing_id': '2',
+                'seats_booked': '1', 'seat_numbers': seat, 'total_price': '12.00',
+                'booking_date': '2025-10-01T12:00:00'}
+
+    def test_stale_commit_fails_alone(self):
+        handler.init()
+        # The stale commit read the bookings before another process booked
+        handler._operation.reads = {}
+        try:
+            handler._table_rows('bookings')
+            stale_reads = dict(handler._operation.reads)
+        finally:
+            handler._operation.reads = None
+        self.run_python("import handler; assert handler.book_tickets('3', '2', ['H1'])")
+
+        stale = handler._Commit({'bookings': ([self.booking('2', 'H1')], [], [])}, stale_reads)
+        fresh = handler._Commit({'bookings': ([self.booking('2', 'H2')], [], [])}, {})
+        handler._write_batch([stale, fresh])
+
+        self.assertIsInstance(stale.future.exception(), storage.StaleWriteError)
+        self.assertIsNone(fresh.future.result())
+        seats = {booking.seat_numbers: booking.user_id for booking in self.stored('bookings')
+                 if booking.showing_id == 2}
+        self.assertEqual(seats, {'H1': 3, 'H2': 2})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+"""Behaviour tests for sharing the tables between processes.
+
+Every test works on copies of the data files in a temporary directory, with
+freshly imported storage and handler modules. Run from the project root:
+
+    python -m unittest discover tests
+"""
+import subprocess
+import sys
+import time
+import unittest
+
+from support import DataDirTestCase
+
+class TwoProcessesTest(DataDirTestCase):
+
+    def test_same_seat_is_booked_once(self):
+        # Both processes try the same seats at the same moment
+        seats = [f"E{number}" for number in range(1, 11)]
+        code = f"""
+import time, handler
+handler.init()
+time.sleep(max(0, {time.time() + 2} - time.time()))
+for seat in {seats!r}:
+    print(seat, handler.book_tickets('{{user}}', '2', [seat]) is not None)
+"""
+        processes = [subprocess.Popen([sys.executable, '-c', code.replace('{user}', user)],
+                                      cwd=self.directory, stdout=subprocess.PIPE, text=True,
+                                      env=self.environment())
+                     for user in ('2', '3')]
+        wins = {seat: 0 for seat in seats}
+        for process in processes:
+            output, _ = process.communicate(timeout=120)
+            self.assertEqual(process.returncode, 0)
+            for line in output.splitlines():
+                seat, booked = line.split()
+                wins[seat] += booked == 'True'
+        self.assertEqual(wins, {seat: 1 for seat in seats})
+
+        booked = [booking.seat_numbers for booking in self.stored('bookings') if booking.showing_id == 2]
+        self.assertEqual(sorted(booked), sorted(seats))
+
+if __name__ == '__main__':
+    unittest.main()
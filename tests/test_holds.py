@@ -0,0 +1,50 @@
+"""Behaviour tests of seat holds and booking the seats they hold.
+
+Run from the project root:
+
+    python -m unittest discover tests
+"""
+import unittest
+
+from support import DataDirTestCase, handler
+
+class BookHeldSeatsTest(DataDirTestCase):
+
+    def book_while_holds_change(self, persist: bool):
+        handler.PERSIST_HOLDS = persist
+        handler.init()
+        self.assertIsNotNone(handler.hold_seats('2', '2', ['F1', 'F2']))
+
+        # Another process holds other seats right after the booking is stored
+        submit = handler._submit
+        def submit_then_other_hold(changes):
+            future = submit(changes)
+            future.result()
+            if not calls:
+                self.run_python("import handler; handler.PERSIST_HOLDS = True; "
+                                "assert handler.hold_seats('3', '2', ['F9'])")
+            calls.append(changes)
+            return future
+        calls = []
+        handler._submit = submit_then_other_hold
+        self.addCleanup(setattr, handler, '_submit', submit)
+
+        booking_id = handler.book_tickets('2', '2', ['F1', 'F2'])
+        self.assertIsNotNone(booking_id)
+        booked = [booking.booking_id for booking in self.stored('bookings') if booking.seat_numbers == 'F1,F2']
+        self.assertEqual(booked, [int(booking_id)])
+        self.assertEqual(handler._user_holds('2', '2'), [])
+        return calls
+
+    def test_persisted_holds_are_released_with_the_booking(self):
+        calls = self.book_while_holds_change(persist=True)
+        # One write stored both, so the other hold has nothing left to make stale
+        self.assertEqual([sorted(changes) for changes in calls], [['bookings', 'holds']])
+        self.assertEqual([(hold.user_id, hold.seat_numbers) for hold in self.stored('holds')], [('3', 'F9')])
+
+    def test_holds_in_memory_are_released_after_the_booking(self):
+        calls = self.book_while_holds_change(persist=False)
+        self.assertEqual([sorted(changes) for changes in calls], [['bookings']])
+
+if __name__ == '__main__':
+    unittest.main()
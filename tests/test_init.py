@@ -0,0 +1,36 @@
+"""Behaviour tests of setting up the tables while other threads already read them.
+
+Run from the project root:
+
+    python -m unittest discover tests
+"""
+import threading
+import time
+import unittest
+
+from support import DataDirTestCase, handler, storage
+
+class InitRaceTest(DataDirTestCase):
+
+    def test_init_racing_first_read(self):
+        # Hold init up in the middle of setting up the tables
+        create_missing = storage.CSVBackend.create_missing
+        def slow_create_missing(backend, seed):
+            time.sleep(0.2)
+            return create_missing(backend, seed)
+        storage.CSVBackend.create_missing = slow_create_missing
+        self.addCleanup(setattr, storage.CSVBackend, 'create_missing', create_missing)
+
+        showings = []
+        initializing = threading.Thread(target=handler.init, daemon=True)
+        reading = threading.Thread(target=lambda: showings.extend(handler.get_movies_showings()), daemon=True)
+        initializing.start()
+        time.sleep(0.05)
+        reading.start()
+        initializing.join(10)
+        reading.join(10)
+        self.assertFalse(initializing.is_alive() or reading.is_alive(), 'init and the first read deadlocked')
+        self.assertEqual(len(showings), 4)
+
+if __name__ == '__main__':
+    unittest.main()
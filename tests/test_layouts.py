@@ -0,0 +1,118 @@
+"""Tests of seat layouts: parsing specs and mapping seats to bitsets.
+
+Run from the project root:
+
+    python -m unittest discover tests
+"""
+import unittest
+
+from support import DataDirTestCase, handler
+from layouts import _parse_sections, parse_layout, row_label, uniform_layout
+
+class ParseLayoutTest(unittest.TestCase):
+
+    def test_row_labels_go_past_z(self):
+        self.assertEqual([row_label(index) for index in (0, 25, 26, 27, 51, 52, 701, 702)],
+                         ['A', 'Z', 'AA', 'AB', 'AZ', 'BA', 'ZZ', 'AAA'])
+        layout = parse_layout('28*2')
+        self.assertEqual(layout.row_labels[25:], ('Z', 'AA', 'AB'))
+        self.assertEqual(layout.labels[-2:], ('AB1', 'AB2'))
+
+    def test_seats_are_numbered_across_aisles(self):
+        layout = parse_layout('2,1a,2x/1w,3')
+        self.assertEqual(layout.grid, (('A1', 'A2', '', 'A3', 'A4'), ('B1', 'B2', 'B3', 'B4')))
+        self.assertEqual(layout.width, 5)
+        self.assertEqual(layout.capacity, 6)
+        self.assertEqual(layout.seats_in(layout.blocked_mask), ['A3', 'A4'])
+        self.assertEqual(layout.seats_in(layout.accessible_mask), ['B1'])
+
+    def test_bad_specs_are_refused(self):
+        for spec in ('', '/', '3q', 'x', '2*', 'a*3', '3,,4'):
+            with self.assertRaises(ValueError, msg=spec):
+                parse_layout(spec)
+
+    def test_sections(self):
+        self.assertEqual(_parse_sections('Stalls:1-3, Circle:4,', 4), (('Stalls', 0, 2), ('Circle', 3, 3)))
+        self.assertEqual(_parse_sections('', 4), ())
+        for spec in ('Stalls', ':1-2', 'Stalls:2-1', 'Stalls:0-1', 'Stalls:1-5', 'Stalls:a-b'):
+            with self.assertRaises(ValueError, msg=spec):
+                _parse_sections(spec, 4)
+        self.assertEqual(parse_layout('4*5', 'Front:1-2').sections, (('Front', 0, 1),))
+
+    def test_uniform_layout(self):
+        layout = uniform_layout(25)
+        self.assertEqual(layout.rows, '2*10/5')
+        self.assertEqual(layout.capacity, 25)
+        self.assertEqual(layout.labels[-1], 'C5')
+        self.assertIs(parse_layout(layout.rows).labels, parse_layout(layout.rows).labels)
+
+class MaskTest(unittest.TestCase):
+
+    def test_mask(self):
+        layout = parse_layout('2,1a,1x,1/3')
+        self.assertEqual(layout.mask([]), 0)
+        self.assertEqual(layout.mask(['A1', 'B1']), 0b10001)
+        self.assertEqual(layout.seats_in(layout.mask(['B3', 'A4'])), ['A4', 'B3'])
+
+    def test_unknown_blocked_or_repeated_seats(self):
+        layout = parse_layout('2,1a,1x,1/3')
+        self.assertIsNone(layout.mask(['A5']))
+        self.assertIsNone(layout.mask(['A3']))
+        self.assertIsNone(layout.mask(['A1', 'A1']))
+        self.assertIsNone(layout.mask(['']))
+
+    def test_booked_bits_skip_unknown_seats(self):
+        layout = parse_layout('2,1a,1x,1/3')
+        self.assertEqual(layout.booked_bits('A1,Z9,B1'), 0b10001)
+
+class BestBlockTest(unittest.TestCase):
+
+    def free(self, layout, taken=()):
+        return ((1 << len(layout.labels)) - 1) & ~layout.mask(list(taken))
+
+    def test_blocks_do_not_span_aisles_or_rows(self):
+        layout = parse_layout('3,1a,3/3,1a,3')
+        self.assertEqual(layout.best_block(self.free(layout), 4), [])
+        self.assertEqual(layout.best_block(self.free(layout), 3, 0.0), ['A1', 'A2', 'A3'])
+        # A3 and A4 are across the aisle, A6 and B1 across rows
+        self.assertEqual(layout.best_block(self.free(layout, ['A1', 'A2', 'A5', 'B2', 'B3', 'B4', 'B5']), 2), [])
+
+    def test_ideal_row_and_middle(self):
+        layout = parse_layout('5*9')
+        free = self.free(layout)
+        self.assertEqual(layout.best_block(free, 3, 0.0), ['A4', 'A5', 'A6'])
+        self.assertEqual(layout.best_block(free, 3, 1.0), ['E4', 'E5', 'E6'])
+        self.assertEqual(layout.best_block(free, 3, 0.5), ['C4', 'C5', 'C6'])
+        # Taken middle seats push the block aside within the ideal row
+        self.assertEqual(layout.best_block(self.free(layout, ['A4']), 3, 0.0), ['A5', 'A6', 'A7'])
+        self.assertEqual(layout.best_block(free, 0), [])
+        self.assertEqual(layout.best_block(free, 10), [])
+
+    def test_rows_clip_the_search(self):
+        layout = parse_layout('4*4', 'Front:1-2,Back:3-4')
+        free = self.free(layout)
+        self.assertEqual(layout.best_block(free, 2, 1.0, (0, 1)), ['B2', 'B3'])
+        self.assertEqual(layout.best_block(free, 2, 0.0, (2, 3)), ['C2', 'C3'])
+        # ideal_row counts over the rows searched: the front of the back section
+        self.assertEqual(layout.best_block(self.free(layout, ['C1', 'C2', 'C3']), 2, 0.0, (2, 3)), ['D2', 'D3'])
+        self.assertEqual(layout.best_block(self.free(layout, ['C2', 'C3', 'D2', 'D3']), 2, 0.0, (2, 3)), [])
+
+    def test_accessible_blocks_hold_an_accessible_seat(self):
+        layout = parse_layout('4/4/2,1w,1')
+        free = self.free(layout)
+        self.assertEqual(layout.best_block(free, 2, 0.0), ['A2', 'A3'])
+        self.assertEqual(layout.best_block(free, 2, 0.0, accessible=True), ['C2', 'C3'])
+        self.assertEqual(layout.best_block(self.free(layout, ['C3']), 2, accessible=True), [])
+
+class SetTheatreLayoutTest(DataDirTestCase):
+
+    def test_layout_must_keep_the_booked_seats(self):
+        # Showing 1 of theatre 1 has A1-A3 booked; this layout blocks them
+        self.assertFalse(handler.set_theatre_layout('1', '3x,7'))
+        self.assertIsNone(handler.get_theatre_layout('1'))
+
+        self.assertTrue(handler.set_theatre_layout('1', '3,1a,7/9*10'))
+        self.assertEqual(handler.get_theatre_layout('1').rows, '3,1a,7/9*10')
+        seats = handler.get_seat_layout('1')
+        self.assertEqual(seats['booked_seats'], ['A1', 'A2', 'A3'])
+        self.assertEqual(seats['total_seats'], 100)
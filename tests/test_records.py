@@ -0,0 +1,41 @@
+"""Tests of the typed rows and their text formats.
+
+Run from the project root:
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from records import format_cents, parse_cents
+
+class CentsTest(unittest.TestCase):
+
+    def test_parse_stored_prices(self):
+        self.assertEqual(parse_cents('12'), 1200)
+        self.assertEqual(parse_cents('12.5'), 1250)
+        self.assertEqual(parse_cents('12.05'), 1205)
+        self.assertEqual(parse_cents('0.99'), 99)
+        self.assertIsNone(parse_cents(''))
+
+    def test_parse_float_artefacts(self):
+        self.assertEqual(parse_cents('36.000000000000004'), 3600)
+        self.assertEqual(parse_cents('35.999999999999996'), 3600)
+        self.assertEqual(parse_cents('1.005'), 101)
+
+    def test_format(self):
+        self.assertEqual(format_cents(1250), '12.50')
+        self.assertEqual(format_cents(5), '0.05')
+        self.assertEqual(format_cents(0), '0.00')
+        self.assertEqual(format_cents(None), '')
+
+    def test_round_trip(self):
+        for cents in (0, 1, 99, 100, 1205, 123456):
+            self.assertEqual(parse_cents(format_cents(cents)), cents)
+
+if __name__ == '__main__':
+    unittest.main()
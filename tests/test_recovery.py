@@ -0,0 +1,78 @@
+"""Behaviour tests of finishing writes a crashed process logged but did not apply.
+
+Run from the project root:
+
+    python -m unittest discover tests
+"""
+import os
+import unittest
+
+from support import DataDirTestCase, handler, storage
+
+class CrashRecoveryTest(DataDirTestCase):
+
+    # Deletes user 1 and their booking, then dies between the two tables
+    CRASH_IN_DELETE_USER = """
+import os, handler
+handler.init()
+backend = handler._storage()
+apply = backend._apply
+def crash(table, *args):
+    if table == 'bookings':
+        os._exit(3)
+    return apply(table, *args)
+backend._apply = crash
+handler.delete_user('1')
+"""
+
+    # Books seat G5 on showing 2, then dies after logging the booking but before storing it
+    CRASH_IN_BOOKING = """
+import os, handler
+handler.init()
+handler._storage()._apply = lambda *args: os._exit(3)
+handler.book_tickets('3', '2', ['G5'])
+"""
+
+    def assert_torn(self):
+        self.assertNotIn(1, [user.user_id for user in self.stored('users')])
+        self.assertIn(1, [booking.user_id for booking in self.stored('bookings')])
+
+    def assert_user_1_gone(self):
+        self.assertNotIn(1, [user.user_id for user in self.stored('users')])
+        self.assertNotIn(1, [booking.user_id for booking in self.stored('bookings')])
+        self.assertEqual(os.path.getsize(storage.WAL_PATH), 0)
+
+    def test_startup_finishes_the_write(self):
+        self.assertEqual(self.run_python(self.CRASH_IN_DELETE_USER, check=False).returncode, 3)
+        self.assert_torn()
+
+        handler.init()
+        self.assert_user_1_gone()
+        self.assertEqual(handler.get_user_bookings('1'), [])
+
+    def test_checkpoint_in_live_process_finishes_the_write(self):
+        handler.init()
+        self.assertEqual(self.run_python(self.CRASH_IN_DELETE_USER, check=False).returncode, 3)
+        self.assert_torn()
+
+        # The next write checkpoints, which must not throw the crashed write away
+        storage.WAL_CHECKPOINT_BYTES = 0
+        self.assertIsNotNone(handler.book_tickets('2', '2', ['G1']))
+        self.assert_user_1_gone()
+        self.assertEqual(handler.get_user_bookings('1'), [])
+
+    def test_live_process_finishes_the_write_before_its_own(self):
+        handler.init()
+        self.assertNotIn('G5', handler.get_seat_layout('2')['booked_seats'])
+        self.assertEqual(self.run_python(self.CRASH_IN_BOOKING, check=False).returncode, 3)
+        self.assertNotIn('G5', [booking.seat_numbers for booking in self.stored('bookings')])
+
+        # Taking the bookings for a write replays the logged booking first,
+        # which makes this process's copy stale
+        self.assertIsNone(handler.book_tickets('2', '2', ['G5']))
+        booked = [booking.user_id for booking in self.stored('bookings') if booking.seat_numbers == 'G5']
+        self.assertEqual(booked, [3])
+        self.assertIsNotNone(handler.book_tickets('2', '2', ['G6']))
+
+if __name__ == '__main__':
+    unittest.main()
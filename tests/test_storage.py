@@ -0,0 +1,158 @@
+"""Tests of the storage backends on their own, in a temporary directory.
+
+Run from the project root:
+
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import storage
+from records import Booking, Hold
+
+class CSVBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.directory = temp.name
+        fsync_policy, storage.FSYNC_POLICY = storage.FSYNC_POLICY, 'never'
+        self.addCleanup(setattr, storage, 'FSYNC_POLICY', fsync_policy)
+        self.backend = storage.CSVBackend({table: os.path.join(self.directory, filename)
+                                           for table, filename in storage.CSV_FILES.items()})
+        self.backend.create_missing({})
+
+    def hold(self, number: int) -> Hold:
+        return Hold(f"hold{number}", '1', '1', 'A1', 2000000000)
+
+    def test_inserts_after_dead_rows_do_not_read_every_row(self):
+        rows = {}
+        def write(inserted=(), deleted=()):
+            for row in inserted:
+                rows[row.hold_id] = row
+            for row_id in deleted:
+                rows.pop(row_id)
+            signature = self.backend.signature('holds')
+            self.backend.write_changes('holds', signature, list(inserted), [], list(deleted), all_rows)
+        calls = []
+        def all_rows():
+            calls.append(len(rows))
+            return list(rows.values())
+
+        write(inserted=[self.hold(number) for number in range(1000)])
+        # 120 dead rows: past COMPACT_MIN_DEAD_ROWS, far below COMPACT_RATIO of the live ones
+        write(deleted=[f"hold{number}" for number in range(60)])
+        calls.clear()
+        for number in range(1000, 1050):
+            write(inserted=[self.hold(number)])
+        self.assertEqual(calls, [])
+
+        # Once enough rows are dead the file is still compacted
+        write(deleted=[f"hold{number}" for number in range(60, 800)])
+        self.assertTrue(calls)
+        self.assertEqual(self.backend._dead_rows['holds'][1], 0)
+        self.assertEqual(len(self.backend.load('holds')[1]), 250)
+
+    def test_tail_is_not_read_across_a_rewrite(self):
+        # Every file looks like the same inode, as when a rewrite gets the old one back
+        file_signature = storage._file_signature
+        storage._file_signature = lambda stat_result: file_signature(stat_result)[:2] + (1,)
+        self.addCleanup(setattr, storage, '_file_signature', file_signature)
+        self.backend.write_changes('holds', self.backend.signature('holds'),
+                                   [self.hold(number) for number in range(3)], [], [], None)
+        signature, _ = self.backend.load('holds')
+
+        # Another process rewrites the file whole, longer than it was
+        other = storage.CSVBackend(self.backend.files)
+        with other._lock('holds', exclusive=True) as lock_fd:
+            other._rewrite('holds', [self.hold(number) for number in range(100, 110)], lock_fd)
+        self.assertIsNone(self.backend.load_since('holds', signature))
+        self.assertEqual(len(self.backend.load('holds')[1]), 10)
+
+class SQLiteBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        self.directory = temp.name
+        self.backend = storage.SQLiteBackend(os.path.join(self.directory, 'pvc.db'))
+        self.backend.create_missing({'users': [
+            {'user_id': '1', 'username': 'demo', 'password': 'x', 'salt': 'y',
+             'email': 'demo@demo.com', 'status': 'active'}]})
+
+    def booking(self, booking_id: int, showing_id: int, seats: str) -> Booking:
+        return Booking(booking_id, 1, showing_id, len(seats.split(',')), seats, 1200 * len(seats.split(',')),
+                       '2025-10-01T12:00:00')
+
+    def write(self, table: str, inserted=(), updated=(), deleted=()):
+        return self.backend.write_changes(table, self.backend.signature(table), list(inserted),
+                                          list(updated), list(deleted), None)
+
+    def test_create_missing_seeds_only_new_tables(self):
+        self.assertEqual([user.username for user in self.backend.load('users')[1]], ['demo'])
+        self.backend.create_missing({'users': [{'user_id': '2', 'username': 'other'}]})
+        self.assertEqual([user.username for user in self.backend.load('users')[1]], ['demo'])
+
+    def test_writes_find_and_totals(self):
+        self.write('bookings', inserted=[self.booking(1, 1, 'A1,A2'), self.booking(2, 1, 'B1'),
+                                         self.booking(3, 2, 'C1')])
+        moved = self.booking(2, 2, 'B1')
+        self.write('bookings', updated=[moved], deleted=['3'])
+
+        self.assertEqual(self.backend.load('bookings')[1], [self.booking(1, 1, 'A1,A2'), moved])
+        self.assertEqual(self.backend.find('bookings', 'showing_id', '2'), [moved])
+        self.assertEqual(self.backend.find('bookings', 'booking_id', '3'), [])
+        self.assertIsNone(self.backend.find('bookings', 'seat_numbers', 'B1'))
+        self.assertEqual(self.backend.totals('bookings'), {'1': 2, '2': 1})
+
+    def test_stale_write_is_refused(self):
+        signature = self.backend.signature('bookings')
+        self.write('bookings', inserted=[self.booking(1, 1, 'A1')])
+        with self.assertRaises(storage.StaleWriteError):
+            self.backend.write_changes('bookings', signature, [self.booking(2, 1, 'A2')], [], [], None)
+        self.assertEqual(len(self.backend.load('bookings')[1]), 1)
+
+    def test_write_batch_is_all_or_nothing(self):
+        signatures = {table: self.backend.signature(table) for table in ('users', 'bookings')}
+        self.write('bookings', inserted=[self.booking(1, 1, 'A1')])
+        with self.assertRaises(storage.StaleWriteError):
+            self.backend.write_batch({'users': (signatures['users'], [], [], ['1'], None),
+                                      'bookings': (signatures['bookings'], [], [], ['1'], None)})
+        self.assertEqual(len(self.backend.load('users')[1]), 1)
+        self.assertEqual(len(self.backend.load('bookings')[1]), 1)
+
+    def test_reserve_ids_continue_after_existing_rows(self):
+        self.assertEqual(self.backend.reserve_ids('users', 16), 2)
+        self.assertEqual(self.backend.reserve_ids('users', 16), 18)
+
+class MigrateTest(unittest.TestCase):
+
+    def test_copies_every_csv_table(self):
+        temp = tempfile.TemporaryDirectory()
+        self.addCleanup(temp.cleanup)
+        for name in os.listdir(ROOT):
+            if name.endswith('.csv'):
+                shutil.copy(os.path.join(ROOT, name), temp.name)
+        shutil.copytree(os.path.join(ROOT, 'bookings'), os.path.join(temp.name, 'bookings'))
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(temp.name)
+
+        copied = storage.migrate_csv_to_sqlite('pvc.db')
+
+        source, target = storage.CSVBackend(), storage.SQLiteBackend('pvc.db')
+        for table in storage.CSV_FILES:
+            rows = source.load(table)[1]
+            self.assertEqual(copied[table], len(rows))
+            key = storage.PRIMARY_KEYS[table]
+            self.assertEqual(sorted(target.load(table)[1], key=lambda row: row[key]),
+                             sorted(rows, key=lambda row: row[key]))
+        self.assertGreater(copied['bookings'], 0)
+
+if __name__ == '__main__':
+    unittest.main()